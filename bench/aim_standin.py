@@ -0,0 +1,375 @@
+"""
+A local stand-in for the AiM pages AimSession drives, with the same
+element IDs, so submissions can be run and timed without the real site.
+Every response can be delayed, pages can fail outright and time card
+lines can be rejected at random.
+
+    python -m bench.aim_standin --port 8800 --latency 0.2 --error-rate 0.05
+
+Point an AimSession at it with base_url='http://localhost:8800/fmax/screen/'.
+Any NetID and password log in. The saved time cards are listed as JSON
+at /_standin/cards and request counts at /_standin/stats.
+"""
+import argparse
+import html
+import json
+import random
+import secrets
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterable, Optional
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+from timecard.aim import (CANCEL, DONE, EDIT, NEW, PWD, RTC_ADD, RTC_HOURS,
+                          RTC_LEAVE_CODE, RTC_SAVE, RTC_SHOP_PERSON,
+                          RTC_WORK_DATE, SAVE, SUBMIT, TC_ACTION, TC_ADD_FIRST,
+                          TC_ADD_NEXT, TC_DATE, TC_DECRIPTION, TC_ERROR_MSG,
+                          TC_HOURS, TC_ITEM_NUM, TC_LABOR_CODE, TC_LEAVE_CODE,
+                          TC_LINE, TC_LINE_SELECT, TC_PERSON, TC_PHASE,
+                          TC_REMOVE, TC_WORKORDER, UID, WO_NUMBER)
+
+SCREEN = '/fmax/screen/'
+LOGIN = '/weblogin'
+COOKIE = 'standin_session'
+# Detail form fields, as (element ID, form field)
+LINE_FIELDS = ((TC_WORKORDER, 'workorder'), (TC_PHASE, 'phase'),
+               (TC_HOURS, 'hours'), (TC_DECRIPTION, 'description'),
+               (TC_ACTION, 'action'), (TC_LEAVE_CODE, 'leave_code'),
+               (TC_LABOR_CODE, 'labor_code'))
+
+
+class StandIn:
+    """
+    The state of the stand-in: login sessions, the time card each session
+    is editing, and the saved time cards. Every request waits 'latency'
+    plus up to 'jitter' seconds; a 'fail_rate' share of them are answered
+    with an error page, and an 'error_rate' share of time card lines, as
+    well as any line on an 'invalid' workorder, are rejected.
+    """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0,
+                 error_rate: float = 0.0, fail_rate: float = 0.0,
+                 invalid: Iterable[str] = (), seed: Optional[int] = None) -> None:
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.fail_rate = fail_rate
+        self.invalid = set(invalid)
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.sessions: Dict[str, dict] = {}
+        self.cards: Dict[int, dict] = {}
+        self.stats = Counter()
+
+    def serve(self, port: int = 0, host: str = 'localhost') -> ThreadingHTTPServer:
+        "Start serving from a daemon thread; port 0 picks a free port"
+        server = ThreadingHTTPServer((host, port), _handler(self))
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+    def delay(self) -> None:
+        time.sleep(self.latency + self.random.uniform(0, self.jitter))
+
+    def fails(self) -> bool:
+        with self.lock:
+            return self.random.random() < self.fail_rate
+
+    def reject(self, line: dict) -> str:
+        "Why AiM would refuse a time card line, or ''"
+        try:
+            float(line['hours'])
+        except ValueError:
+            return f'Hours {line["hours"]!r} are not a number'
+        if line['leave_code']:
+            return ''
+        workorder, phase = line['workorder'], line['phase']
+        if not (len(workorder) == 6 and workorder.isdigit()
+                and len(phase) == 3 and phase.isdigit()):
+            return f'Work order {workorder} phase {phase} does not exist'
+        if workorder in self.invalid:
+            return f'Work order {workorder} is closed to time entry'
+        with self.lock:
+            if self.random.random() < self.error_rate:
+                return f'Work order {workorder} phase {phase} is not valid'
+        return ''
+
+    def save(self, draft: dict) -> int:
+        with self.lock:
+            card_id = draft['id'] or len(self.cards) + 1
+            self.cards[card_id] = {
+                'person': draft['person'], 'date': draft['date'],
+                'lines': {item: dict(line)
+                          for item, line in sorted(draft['lines'].items())}}
+        return card_id
+
+
+def _page(title: str, body: str, action: str = '') -> bytes:
+    form = (f'<form id="mainForm" method="post" action="{action}">{body}</form>'
+            if action else body)
+    return (f'<!DOCTYPE html><html><head><title>{html.escape(title)}</title>'
+            f'</head><body>{form}</body></html>').encode()
+
+
+def _input(element_id: str, name: str, value: str = '', kind: str = 'text',
+           readonly: bool = False) -> str:
+    return (f'<label>{html.escape(name)} <input type="{kind}" '
+            f'id="{element_id}" name="{name}" value="{html.escape(value)}"'
+            f'{" readonly" if readonly else ""}></label><br>')
+
+
+def _button(element_id: str, value: str, label: str) -> str:
+    return (f'<button type="submit" id="{element_id}" name="button" '
+            f'value="{html.escape(value)}">{html.escape(label)}</button>')
+
+
+def _card_page(draft: dict) -> bytes:
+    "The time card being edited, with its lines"
+    rows = ''.join(
+        f'<tr><td>{_button(TC_LINE.format(item), f"line:{item}", str(item))}</td>'
+        f'<td><input type="checkbox" id="{TC_LINE_SELECT.format(item)}" '
+        f'name="select" value="{item}"></td>'
+        f'<td>{html.escape(line["workorder"] or line["leave_code"])}</td>'
+        f'<td>{html.escape(line["phase"])}</td>'
+        f'<td>{html.escape(line["hours"])}</td>'
+        f'<td>{html.escape(line["description"])}</td></tr>'
+        for item, line in sorted(draft['lines'].items()))
+    body = (_input(TC_PERSON, 'person', draft['person'])
+            + _input(TC_DATE, 'date', draft['date'])
+            + f'<table>{rows}</table>'
+            + _button(TC_ADD_FIRST, 'add', 'Add')
+            + _button(TC_REMOVE, 'remove', 'Remove')
+            + _button(DONE, 'done', 'Done') + _button(SAVE, 'save', 'Save'))
+    return _page('Time Card Edit', body, SCREEN + 'TIMECARD_EDIT')
+
+
+def _detail_page(item: int, line: dict, error: str = '') -> bytes:
+    "The detail form of one time card line"
+    body = (_input(TC_ITEM_NUM, 'item', str(item), readonly=True)
+            + ''.join(_input(element_id, name, line.get(name, ''))
+                      for element_id, name in LINE_FIELDS)
+            + (f'<div id="{TC_ERROR_MSG}">{html.escape(error)}</div>'
+               if error else '')
+            + _button(TC_ADD_NEXT, 'next', 'Add next')
+            + _button(DONE, 'done', 'Done') + _button(SAVE, 'save', 'Save')
+            + _button(CANCEL, 'cancel', 'Cancel'))
+    return _page('Time Card Detail Edit', body, SCREEN + 'TIMECARD_EDIT')
+
+
+def _handler(standin: StandIn):
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            self._handle(parse_qs(urlsplit(self.path).query))
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            self._handle(parse_qs(self.rfile.read(length).decode(),
+                                  keep_blank_values=True))
+
+        def _handle(self, form):
+            path = urlsplit(self.path).path
+            page = path[len(SCREEN):] if path.startswith(SCREEN) else path
+            with standin.lock:
+                standin.stats[f'{self.command} {page}'] += 1
+            standin.delay()
+            if path.startswith('/_standin/'):
+                return self._standin(path)
+            if path == '/favicon.ico':
+                return self._send(b'', 'image/x-icon')
+            if standin.fails():
+                with standin.lock:
+                    standin.stats['failed'] += 1
+                return self._send(_page('Service Unavailable',
+                                        '<h1>Service Unavailable</h1>'), status=503)
+            if path == LOGIN:
+                return self._login(form)
+            session = standin.sessions.get(self._cookie())
+            if session is None:
+                target = urlencode({'next': self.path})
+                return self._redirect(f'{LOGIN}?{target}')
+            field = {name: values[-1] for name, values in form.items()}
+            if page == 'WORKDESK':
+                return self._send(_page('AiM WorkDesk', '<h1>WorkDesk</h1>'))
+            if page == 'TIMECARD_VIEW':
+                return self._timecard_view(session, field)
+            if page == 'TIMECARD_EDIT' and session.get('draft'):
+                return self._timecard_edit(session, field, form.get('select', []))
+            if page == 'WO_VIEW':
+                return self._send(_page('Work Order View',
+                                        _input(WO_NUMBER, 'proposal',
+                                               field.get('proposal', ''))))
+            if page == 'RAPID_TIMECARD_EDIT':
+                return self._rapid_timecard(session, field)
+            self._send(_page('Not Found', '<h1>Not Found</h1>'), status=404)
+
+        def _login(self, form):
+            field = {name: values[-1] for name, values in form.items()}
+            if self.command == 'POST' and field.get('netid'):
+                token = secrets.token_hex(16)
+                with standin.lock:
+                    standin.sessions[token] = {'netid': field['netid']}
+                return self._redirect(field.get('next') or SCREEN + 'WORKDESK',
+                                      f'{COOKIE}={token}; Path=/')
+            body = (_input(UID, 'netid') + _input(PWD, 'password', kind='password')
+                    + f'<input type="hidden" name="next" '
+                    f'value="{html.escape(field.get("next", ""))}">'
+                    + f'<button type="submit" id="{SUBMIT}">Sign in</button>')
+            self._send(_page('UW NetID sign-in', body, LOGIN))
+
+        def _timecard_view(self, session, field):
+            action = field.get('button')
+            if action == 'new':
+                session['draft'] = {'id': None, 'person': '', 'date': '',
+                                    'lines': {}}
+                return self._send(_card_page(session['draft']))
+            card_id = int(field.get('id') or 0)
+            card = standin.cards.get(card_id)
+            if card and action == 'edit':
+                session['draft'] = {'id': card_id, 'person': card['person'],
+                                    'date': card['date'],
+                                    'lines': {item: dict(line) for item, line
+                                              in card['lines'].items()}}
+                return self._send(_card_page(session['draft']))
+            if card:
+                rows = ''.join(f'<li>{item}: {html.escape(json.dumps(line))}</li>'
+                               for item, line in card['lines'].items())
+                body = (f'<input type="hidden" name="id" value="{card_id}">'
+                        f'<ul>{rows}</ul>' + _button(EDIT, 'edit', 'Edit'))
+                return self._send(_page('Time Card View', body,
+                                        f'{SCREEN}TIMECARD_VIEW?id={card_id}'))
+            self._send(_page('Time Card View', _button(NEW, 'new', 'New'),
+                             SCREEN + 'TIMECARD_VIEW'))
+
+        def _timecard_edit(self, session, field, selected):
+            draft = session['draft']
+            action = field.get('button', '')
+            for name in ('person', 'date'):
+                if name in field:
+                    draft[name] = field[name]
+            if 'item' in field and action != 'cancel':
+                item = int(field['item'])
+                line = {name: field.get(name, '').strip()
+                        for _, name in LINE_FIELDS}
+                error = standin.reject(line)
+                if error and action != 'save':
+                    with standin.lock:
+                        standin.stats['rejected'] += 1
+                    return self._send(_detail_page(item, line, error))
+                if not error:
+                    draft['lines'][item] = line
+            if action == 'add' or action == 'next':
+                return self._send(_detail_page(max(draft['lines'], default=0) + 1, {}))
+            if action.startswith('line:'):
+                item = int(action[len('line:'):])
+                return self._send(_detail_page(item, draft['lines'].get(item, {})))
+            if action == 'remove':
+                for item in selected:
+                    draft['lines'].pop(int(item), None)
+            if action == 'save':
+                card_id = standin.save(draft)
+                session.pop('draft')
+                return self._redirect(f'{SCREEN}TIMECARD_VIEW?id={card_id}')
+            self._send(_card_page(draft))
+
+        def _rapid_timecard(self, session, field):
+            "Leave for several days at once, saved as one time card each"
+            rapid = session.setdefault('rapid', [])
+            if field.get('button') == 'add':
+                rapid.append(field.get('date', ''))
+            elif field.get('button') == 'save':
+                for work_date in rapid:
+                    line = {name: '' for _, name in LINE_FIELDS}
+                    line.update(leave_code=field.get('leave_code', ''),
+                                hours=field.get('hours', ''))
+                    standin.save({'id': None, 'person': field.get('person', ''),
+                                  'date': work_date, 'lines': {1: line}})
+                rapid.clear()
+            body = (_input(RTC_SHOP_PERSON, 'person', field.get('person', ''))
+                    + _input(RTC_LEAVE_CODE, 'leave_code', field.get('leave_code', ''))
+                    + _input(RTC_HOURS, 'hours', field.get('hours', ''))
+                    + _input(RTC_WORK_DATE, 'date')
+                    + _button(RTC_ADD, 'add', 'Add') + _button(RTC_SAVE, 'save', 'Save'))
+            self._send(_page('Rapid Time Card Edit', body,
+                             SCREEN + 'RAPID_TIMECARD_EDIT'))
+
+        def _standin(self, path):
+            with standin.lock:
+                if path == '/_standin/cards':
+                    data = standin.cards
+                else:
+                    data = dict(standin.stats)
+                body = json.dumps(data, indent=1).encode()
+            self._send(body, 'application/json')
+
+        def _cookie(self) -> str:
+            for part in (self.headers.get('Cookie') or '').split(';'):
+                name, _, value = part.strip().partition('=')
+                if name == COOKIE:
+                    return value
+            return ''
+
+        def _redirect(self, location, cookie=None):
+            self.send_response(303)
+            self.send_header('Location', location)
+            if cookie:
+                self.send_header('Set-Cookie', cookie)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def _send(self, body, content_type='text/html; charset=utf-8', status=200):
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return Handler
+
+
+def parser() -> argparse.ArgumentParser:
+    p = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    p.add_argument('--port', type=int, default=8800)
+    add_arguments(p)
+    return p
+
+
+def add_arguments(p: argparse.ArgumentParser) -> None:
+    "The stand-in's behaviour options, shared with the benchmark"
+    p.add_argument('--latency', type=float, default=0.0,
+                   help='seconds every response is delayed')
+    p.add_argument('--jitter', type=float, default=0.0,
+                   help='up to this many more seconds of random delay')
+    p.add_argument('--error-rate', type=float, default=0.0,
+                   help='share of time card lines rejected at random')
+    p.add_argument('--fail-rate', type=float, default=0.0,
+                   help='share of pages answered with an error page')
+    p.add_argument('--invalid', default='',
+                   help='comma separated workorders that are always rejected')
+    p.add_argument('--seed', type=int, help='seed for the random errors')
+
+
+def from_args(args: argparse.Namespace) -> StandIn:
+    return StandIn(args.latency, args.jitter, args.error_rate, args.fail_rate,
+                   filter(None, args.invalid.split(',')), args.seed)
+
+
+def main() -> None:
+    args = parser().parse_args()
+    server = from_args(args).serve(args.port)
+    host, port = server.server_address[:2]
+    print(f'AiM stand-in at http://{host}:{port}{SCREEN}', flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+"""
+End-to-end submission benchmark: drives AimSession with headless Firefox
+against the AiM stand-in and reports where the time goes, per session
+step and per time card line.
+
+    python -m bench.submit_bench --cards 5 --lines 8 --latency 0.1
+
+Each card is first submitted in full, then re-submitted with one line
+changed, which only sends the difference, and as many days again are
+entered as leave. Needs Firefox and geckodriver.
+"""
+import argparse
+import json
+import statistics
+import sys
+import time
+import urllib.request
+from collections import defaultdict
+from datetime import date, timedelta
+from operator import sub
+from typing import Dict, List
+
+from timecard.aim import DATE_FORMAT, SAVED, AimSession
+from timecard.database import TimeCard, TimeCardEntry
+from timecard.submit import SUBMITTED, submit_day
+
+from .aim_standin import SCREEN, add_arguments, from_args
+
+
+class TimedSession(AimSession):
+    "An AimSession that records the time spent in each call of its steps"
+
+    STEPS = ('ensure_login', 'get', 'click', 'send_keys_to', 'clear',
+             'fill_line', 'item_number', 'add_next_line', 'line_error',
+             'vacation')
+
+    def __init__(self, **kwargs) -> None:
+        self.timings: Dict[str, List[float]] = defaultdict(list)
+        started = time.perf_counter()
+        super().__init__(**kwargs)
+        self.timings['start browser'].append(time.perf_counter() - started)
+        # instance attributes win over methods, so calls between steps are
+        # timed too; 'get' is the driver's
+        for name in self.STEPS:
+            setattr(self, name, self._timed(name, getattr(self, name)))
+
+    def _timed(self, name, step):
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return step(*args, **kwargs)
+            finally:
+                self.timings[name].append(time.perf_counter() - started)
+        return timed
+
+
+def make_card(work_date: date, lines: int) -> TimeCard:
+    "A card of 'lines' labour lines adding up to eight hours"
+    hours = round(8 / lines, 2)
+    entries = [TimeCardEntry(work_date, i, f'{100000 + i:06}', '001',
+                             hours if i else 8 - hours * (lines - 1),
+                             f'BENCH LINE {i}', 'WORK COMPLETE', 'R')
+               for i in range(lines)]
+    return TimeCard(work_date, entries)
+
+
+def run(args: argparse.Namespace, base_url: str) -> dict:
+    session = TimedSession(netid='bench', base_url=base_url, password='bench',
+                           cookie_file=None, debug=args.show)
+    marks: Dict[str, List[float]] = defaultdict(list)
+    results = []
+    try:
+        session.ensure_login()
+        first = date(2024, 1, 1)
+        cards = [make_card(first + timedelta(days=i), args.lines)
+                 for i in range(args.cards)]
+        submitted = {}
+        for mode in ('new', 'edit'):
+            for card in cards:
+                previous = submitted.get(card.date)
+                if previous:
+                    card.entries[-1].description += ' CHANGED'
+                events = []
+                started = time.perf_counter()
+                result = submit_day(session, 'BENCH', card.date, card,
+                                    lambda _, event: events.append(event),
+                                    previous)
+                marks[f'{mode} card'].append(time.perf_counter() - started)
+                results.append((mode, result.status, result.message))
+                submitted[card.date] = result.submission
+                # events are timed from the start of their card, and each
+                # comes before the step it names
+                elapsed = [event.elapsed for event in events]
+                for event, following, took in zip(
+                        events, events[1:], map(sub, elapsed[1:], elapsed)):
+                    step = 'last step + save' if following.step == SAVED else event.step
+                    marks[f'{mode} card {step}'].append(took)
+                if events:
+                    marks[f'{mode} card open'].append(elapsed[0])
+        # the days after the cards taken as leave, in one rapid time card
+        session.vacation('BENCH', [
+            (first + timedelta(days=args.cards + i)).strftime(DATE_FORMAT)
+            for i in range(args.cards)])
+    finally:
+        session.driver.quit()
+    return {'steps': session.timings, 'marks': marks, 'results': results}
+
+
+def report(name: str, times: List[float]) -> str:
+    ms = sorted(t * 1000 for t in times)
+    p95 = ms[min(len(ms) - 1, round(len(ms) * 0.95))]
+    return (f'{name:<28}{len(ms):>6}{sum(ms) / 1000:>10.2f}'
+            f'{statistics.mean(ms):>10.1f}{statistics.median(ms):>10.1f}{p95:>10.1f}')
+
+
+def main(argv=None) -> int:
+    p = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    p.add_argument('--cards', type=int, default=3, help='time cards to submit')
+    p.add_argument('--lines', type=int, default=8, help='lines on each card')
+    p.add_argument('--url', help='use a stand-in already running at this base URL')
+    p.add_argument('--show', action='store_true', help='show the browser')
+    p.add_argument('--json', help='also write the raw timings to this file')
+    add_arguments(p)
+    args = p.parse_args(argv)
+
+    if args.url:
+        base_url = args.url
+    else:
+        server = from_args(args).serve()
+        host, port = server.server_address[:2]
+        base_url = f'http://{host}:{port}{SCREEN}'
+    try:
+        timings = run(args, base_url)
+    except Exception as e:
+        print(f'benchmark failed: {e}', file=sys.stderr)
+        return 1
+
+    print(f'{"step (inclusive)":<28}{"count":>6}{"total s":>10}'
+          f'{"mean ms":>10}{"p50 ms":>10}{"p95 ms":>10}')
+    for group in ('marks', 'steps'):
+        for name, times in sorted(timings[group].items()):
+            print(report(name, times))
+        print()
+    counts = defaultdict(int)
+    for mode, status, _ in timings['results']:
+        counts[f'{mode} {status}'] += 1
+    print(', '.join(f'{n} {key}' for key, n in sorted(counts.items())))
+    stats_url = base_url.split(SCREEN)[0] + '/_standin/stats'
+    with urllib.request.urlopen(stats_url) as f:
+        stats = json.load(f)
+    print(f'{sum(n for k, n in stats.items() if " " in k)} requests served, '
+          f'{stats.get("rejected", 0)} lines rejected, '
+          f'{stats.get("failed", 0)} pages failed')
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({**timings, 'server': stats}, f, indent=1, default=str)
+    return int(any(status != SUBMITTED for _, status, _ in timings['results']))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -5,7 +5,9 @@ setup(name='timecard',
       version=f'{version}',
       packages=find_packages(),
       install_requires=['selenium', 'keyring', 'asciimatics'],
+      extras_require={'parquet': ['pyarrow'],
+                      'cookies': ['cryptography']},
       entry_points={
-          'console_scripts': ['timecard = timecard.tui_main:main']
+          'console_scripts': ['timecard = timecard.cli:main']
       }
       )
@@ -0,0 +1,261 @@
+import sqlite3
+from dataclasses import replace
+from datetime import date
+
+import pytest
+
+from timecard.database import TimeCardDatabase, TimeCardEntry
+
+LEGACY_SCHEMA = """
+CREATE TABLE records
+( work_date DATE,
+line_item INTEGER,
+workorder TEXT,
+phase TEXT,
+hours REAL,
+description TEXT,
+action TEXT,
+time_code TEXT )
+"""
+
+
+def test_migration_keeps_duplicate_line_items(tmp_path):
+    filename = str(tmp_path / "legacy.db")
+    legacy = sqlite3.connect(filename)
+    legacy.execute(LEGACY_SCHEMA)
+    legacy.executemany(
+        "INSERT INTO records VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        [
+            ("2020-01-02", 0, "100000", "001", 4.0, "first", "", "R"),
+            ("2020-01-02", 0, "100001", "001", 2.0, "duplicate", "", "R"),
+            ("2020-01-02", None, "100002", "001", 1.0, "no item", "", "R"),
+            ("2020-01-02", 1, "100003", "001", 1.0, "second", "", "R"),
+            ("2020-01-03", 0, "100004", "001", 8.0, "next day", "", "R"),
+        ],
+    )
+    legacy.commit()
+    legacy.close()
+
+    with TimeCardDatabase(filename, prefetch=False) as db:
+        card = db.get_timecard(date(2020, 1, 2))
+        assert [(e.line_item, e.description) for e in card] == [
+            (0, "first"),
+            (1, "duplicate"),
+            (2, "second"),
+            (3, "no item"),
+        ]
+        assert card.hours == 8.0
+        assert len(db.get_timecard(date(2020, 1, 3))) == 1
+
+
+def test_outbox_queue_claim_finish(tmp_path):
+    with TimeCardDatabase(str(tmp_path / "outbox.db"), prefetch=False) as db:
+        days = [date(2020, 1, 2), date(2020, 1, 3)]
+        assert db.queue_submissions(days + days[:1]) == 2
+        due = db.due_submissions()
+        assert [(e.work_date, e.status, e.attempts) for e in due] == [
+            (days[0], "pending", 0),
+            (days[1], "pending", 0),
+        ]
+
+        claimed = db.claim_submissions(due[:1], 600)
+        assert [(e.work_date, e.status, e.attempts) for e in claimed] == [
+            (days[0], "sending", 1)
+        ]
+        # claimed entries are not due again, nor claimed by another sender
+        assert [e.work_date for e in db.due_submissions()] == days[1:]
+        assert db.claim_submissions(due[:1], 600) == []
+        # queueing a day being sent keeps its claim
+        db.queue_submissions(days[:1], force=True)
+        (entry,) = [e for e in db.outbox() if e.work_date == days[0]]
+        assert (entry.status, entry.attempts, entry.force) == ("sending", 1, True)
+
+        db.finish_submission(claimed[0].id, "submitted", "Done")
+        db.finish_submission(due[1].id, "failed", "rejected")
+        assert db.due_submissions() == []
+        assert db.next_submission() is None
+        assert [(e.work_date, e.status, e.message) for e in db.outbox()] == [
+            (days[1], "failed", "rejected")
+        ]
+        # a failed day can be queued again
+        db.queue_submissions(days[1:])
+        assert [(e.status, e.attempts) for e in db.outbox()] == [("pending", 0)]
+
+
+def test_outbox_retry_and_lease_expiry(tmp_path, monkeypatch):
+    now = 1_000_000.0
+    monkeypatch.setattr("timecard.database.time.time", lambda: now)
+    with TimeCardDatabase(str(tmp_path / "outbox.db"), prefetch=False) as db:
+        db.queue_submissions([date(2020, 1, 2)])
+        (entry,) = db.claim_submissions(db.due_submissions(), 600)
+
+        # a sender that died leaves the entry due once its lease runs out
+        now += 599
+        assert db.due_submissions() == []
+        now += 1
+        assert db.next_submission() == now
+        (entry,) = db.claim_submissions(db.due_submissions(), 600)
+        assert entry.attempts == 2
+
+        db.finish_submission(entry.id, "pending", "timed out", now + 60)
+        assert db.due_submissions() == []
+        assert db.next_submission() == now + 60
+        assert db.expedite_submissions() == 1
+        (entry,) = db.due_submissions()
+        assert (entry.status, entry.attempts, entry.message) == (
+            "pending",
+            2,
+            "timed out",
+        )
+
+
+def test_narrowing_follows_the_search_mode(tmp_path):
+    with TimeCardDatabase(str(tmp_path / "search.db"), prefetch=False) as db:
+        day = date(2020, 1, 2)
+        db.add_records(
+            [
+                TimeCardEntry(day, 0, "100000", "001", 4.0, "a-b"),
+                TimeCardEntry(day, 1, "100001", "001", 4.0, "apple"),
+            ]
+        )
+        found = db.find_records("-", day, day)
+        assert [r.description for r in found] == ["a-b"]
+        expected = sorted(r.description for r in db.find_records("-a", day, day))
+        if db.narrows("-", "-a"):
+            narrowed = [r for r in found if db.matches(r, "-a")]
+            assert sorted(r.description for r in narrowed) == expected
+        assert db.narrows("ap", "app")
+        assert db.narrows("a", "a b")
+        assert not db.narrows("app", "ap")
+
+
+def test_hours_by_workorder_keeps_to_the_dates(tmp_path):
+    with TimeCardDatabase(str(tmp_path / "rollup.db"), prefetch=False) as db:
+        db.add_records(
+            [
+                TimeCardEntry(date(2019, 12, 31), 0, "100000", "001", 8.0),
+                TimeCardEntry(date(2020, 1, 2), 0, "100000", "001", 6.0),
+                TimeCardEntry(date(2020, 1, 2), 1, "100001", "002", 2.0, time_code="O"),
+                TimeCardEntry(date(2020, 2, 3), 0, "100000", "001", 8.0),
+            ]
+        )
+        assert db.hours_by_workorder(date(2020, 1, 1), date(2020, 1, 31)) == {
+            ("100000", "001"): {"R": 6.0},
+            ("100001", "002"): {"O": 2.0},
+        }
+        db.delete_record(date(2020, 1, 2), 1)
+        assert db.hours_by_workorder(date(2019, 12, 1), date(2020, 12, 31)) == {
+            ("100000", "001"): {"R": 22.0}
+        }
+
+
+def card_lines(db, day):
+    return [(e.line_item, e.description) for e in db.get_timecard(day)]
+
+
+def add_card(db, day, *descriptions):
+    db.add_records(
+        [
+            TimeCardEntry(day, item, f"10000{item}", "001", 1.0, description)
+            for item, description in enumerate(descriptions)
+        ]
+    )
+
+
+def test_move_record(tmp_path):
+    with TimeCardDatabase(str(tmp_path / "move.db"), prefetch=False) as db:
+        day = date(2020, 1, 2)
+        add_card(db, day, "a", "b", "c", "d")
+
+        assert db.move_record(day, 0, 2) == 2
+        assert card_lines(db, day) == [(0, "b"), (1, "c"), (2, "a"), (3, "d")]
+        assert db.move_record(day, 3, 0) == 0
+        assert card_lines(db, day) == [(0, "d"), (1, "b"), (2, "c"), (3, "a")]
+        # past the end of the card is clamped to its last line
+        assert db.move_record(day, 1, 10) == 3
+        assert card_lines(db, day) == [(0, "d"), (1, "c"), (2, "a"), (3, "b")]
+        # a missing line, or one that stays put, changes nothing
+        assert db.move_record(day, 7, 0) == 7
+        assert db.move_record(day, 2, 2) == 2
+        assert db.move_record(date(2020, 1, 3), 0, 1) == 0
+        assert card_lines(db, day) == [(0, "d"), (1, "c"), (2, "a"), (3, "b")]
+
+
+def test_delete_record_renumbers_line_items(tmp_path):
+    with TimeCardDatabase(str(tmp_path / "delete.db"), prefetch=False) as db:
+        day, other = date(2020, 1, 2), date(2020, 1, 3)
+        add_card(db, day, "a", "b", "c", "d")
+        add_card(db, other, "x", "y")
+
+        db.delete_record(day, 1)
+        assert card_lines(db, day) == [(0, "a"), (1, "c"), (2, "d")]
+        db.delete_record(day, 2)
+        assert card_lines(db, day) == [(0, "a"), (1, "c")]
+        db.delete_record(day, 0)
+        assert card_lines(db, day) == [(0, "c")]
+        assert card_lines(db, other) == [(0, "x"), (1, "y")]
+        assert db.hours_by_day(day, day) == {day: {"R": 1.0}}
+
+
+def test_add_record_conflict_policies(tmp_path):
+    with TimeCardDatabase(str(tmp_path / "conflict.db"), prefetch=False) as db:
+        day = date(2020, 1, 2)
+        add_card(db, day, "a", "b")
+        clash = TimeCardEntry(day, 0, "200000", "001", 1.0, "new")
+
+        assert db.add_record(clash) is None
+        assert db.add_record(clash, "ignore") is None
+        assert card_lines(db, day) == [(0, "a"), (1, "b")]
+        assert db.add_record(clash, "append") == 2
+        assert card_lines(db, day) == [(0, "a"), (1, "b"), (2, "new")]
+        assert db.add_record(replace(clash, description="replaced"), "replace") == 0
+        assert card_lines(db, day) == [(0, "replaced"), (1, "b"), (2, "new")]
+        assert db.add_record(replace(clash, line_item=3), "append") == 3
+        with pytest.raises(ValueError):
+            db.add_record(clash, "overwrite")
+
+
+def test_add_records_conflict_policies(tmp_path):
+    with TimeCardDatabase(str(tmp_path / "conflict.db"), prefetch=False) as db:
+        day = date(2020, 1, 2)
+        add_card(db, day, "a", "b")
+        batch = [
+            TimeCardEntry(day, 1, "200001", "001", 1.0, "new 1"),
+            TimeCardEntry(day, 2, "200002", "001", 1.0, "new 2"),
+            TimeCardEntry(day, 2, "200003", "001", 1.0, "new 2 again"),
+        ]
+
+        # a line taken in the database or earlier in the batch is a conflict
+        assert db.add_records(batch) == [batch[0], batch[2]]
+        assert card_lines(db, day) == [(0, "a"), (1, "b"), (2, "new 2")]
+        assert db.add_records(batch, "replace") == batch
+        assert card_lines(db, day) == [(0, "a"), (1, "new 1"), (2, "new 2 again")]
+        assert db.add_records(batch[:2], "append") == batch[:2]
+        assert card_lines(db, day) == [
+            (0, "a"),
+            (1, "new 1"),
+            (2, "new 2 again"),
+            (3, "new 1"),
+            (4, "new 2"),
+        ]
+        assert db.add_records([]) == []
+        with pytest.raises(ValueError):
+            db.add_records(batch, "overwrite")
+
+
+def test_update_and_delete_records_report_missing(tmp_path):
+    with TimeCardDatabase(str(tmp_path / "conflict.db"), prefetch=False) as db:
+        day = date(2020, 1, 2)
+        add_card(db, day, "a", "b", "c")
+        missing = TimeCardEntry(day, 5, "200000", "001", 1.0, "missing")
+        changed = TimeCardEntry(day, 1, "200001", "001", 1.0, "changed")
+
+        assert db.update_records([changed, missing]) == [missing]
+        assert card_lines(db, day) == [(0, "a"), (1, "changed"), (2, "c")]
+        assert db.delete_records([(day, 0), (day, 5), (date(2020, 1, 3), 0)]) == [
+            (day, 5),
+            (date(2020, 1, 3), 0),
+        ]
+        assert card_lines(db, day) == [(0, "changed"), (1, "c")]
+        assert db.update_records([]) == []
+        assert db.delete_records([]) == []
@@ -0,0 +1,60 @@
+from timecard.submit import (
+    MAX_RETRY_DELAY,
+    RETRY_DELAY,
+    diff_lines,
+    fingerprint,
+    retry_delay,
+)
+
+FIRST = ("100000", "001", "4", "first", "", "R")
+SECOND = ("100001", "001", "2", "second", "", "R")
+THIRD = ("100002", "001", "2", "third", "", "R")
+FOURTH = ("100003", "001", "1", "fourth", "", "R")
+
+
+def submitted(*entries):
+    return {item: fingerprint(entry) for item, entry in enumerate(entries, 1)}
+
+
+def test_diff_lines_unchanged():
+    lines = submitted(FIRST, SECOND)
+    assert diff_lines(lines, [SECOND, FIRST]) == ({}, [], [])
+
+
+def test_diff_lines_changes_unmatched_lines_in_item_order():
+    lines = submitted(FIRST, SECOND, THIRD)
+    assert diff_lines(lines, [FOURTH, SECOND, FIRST]) == ({3: FOURTH}, [], [])
+
+
+def test_diff_lines_adds_and_removes():
+    lines = submitted(FIRST, SECOND)
+    assert diff_lines(lines, [FIRST, SECOND, THIRD]) == ({}, [THIRD], [])
+    assert diff_lines(lines, [SECOND]) == ({}, [], [1])
+    assert diff_lines({}, [FIRST]) == ({}, [FIRST], [])
+
+
+def test_diff_lines_matches_duplicate_entries_once():
+    lines = submitted(FIRST, FIRST, SECOND)
+    assert diff_lines(lines, [FIRST, SECOND]) == ({}, [], [2])
+    assert diff_lines(lines, [FIRST, THIRD, FIRST, FOURTH]) == (
+        {3: THIRD},
+        [FOURTH],
+        [],
+    )
+
+
+def test_fingerprint_null_fields():
+    blank = ("100000", "001", "4", "", "", "R")
+    assert fingerprint(("100000", "001", "4", None, None, "R")) == fingerprint(blank)
+
+
+def test_retry_delay_doubles_up_to_max():
+    assert [retry_delay(n) for n in range(5)] == [
+        RETRY_DELAY,
+        RETRY_DELAY,
+        2 * RETRY_DELAY,
+        4 * RETRY_DELAY,
+        8 * RETRY_DELAY,
+    ]
+    assert retry_delay(8) == MAX_RETRY_DELAY
+    assert retry_delay(10_000) == MAX_RETRY_DELAY
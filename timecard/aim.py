@@ -1,17 +1,26 @@
 import getpass
+import json
 import os
 import sys
+import threading
 import time
+from contextlib import contextmanager
+from urllib.parse import urljoin, urlsplit
 
-import keyring
-from typing import Optional, Iterable
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.common.keys import Keys
+from typing import (TYPE_CHECKING, Dict, Generator, Iterable, Iterator, List,
+                    NamedTuple, Optional, Tuple)
+
+# selenium and keyring are slow to import, so they are imported only once
+# a session is actually used
+if TYPE_CHECKING:
+    from selenium import webdriver
 
 # URLS
 AIM_BASE = 'https://cmms.admin.washington.edu/fmax/screen/'
 AIM_TRAINING = 'https://cmms-train.admin.washington.edu/fmax/screen/'
+# Any page on the AiM host that loads without logging in; cookies can only
+# be set for the host of the page the browser is on
+COOKIE_PAGE = 'https://cmms.admin.washington.edu/favicon.ico'
 HOME_PAGE = AIM_BASE + 'WORKDESK'
 AIM_TIMECARD = AIM_BASE + 'TIMECARD_VIEW'
 WORKORDER_VIEW = AIM_BASE + 'WO_VIEW'
@@ -43,6 +52,12 @@ TC_LEAVE_CODE = 'mainForm:TIMECARD_DETAIL_EDIT_content:leaveCodeZoom2:level0'
 TC_LABOR_CODE = 'mainForm:TIMECARD_DETAIL_EDIT_content:timeTypeZoom2:level0'
 TC_ITEM_NUM = 'mainForm:TIMECARD_DETAIL_EDIT_content:ae_p_wka_d_item_no'
 TC_ERROR_MSG = 'mainForm:TIMECARD_DETAIL_EDIT_content:messages'
+# Lines of a saved time card, by AiM item number, and removing the selected.
+# UNVERIFIED: these follow the naming of the IDs above but have not been
+# checked against AiM; if editing fails, the card is submitted anew instead.
+TC_LINE = 'mainForm:TIMECARD_EDIT_content:oldTimecardLineList2:item{}'
+TC_LINE_SELECT = 'mainForm:TIMECARD_EDIT_content:oldTimecardLineList2:select{}'
+TC_REMOVE = 'mainForm:TIMECARD_EDIT_content:oldTimecardLineList2:deleteTimecardItemButton2'
 
 RTC_WORK_DATE = 'mainForm:RAPID_TIMECARD_EDIT_content:workDate'
 RTC_SHOP_PERSON = 'mainForm:RAPID_TIMECARD_EDIT_content:shopPersonZoom0:shopPersonZoom'
@@ -82,6 +97,46 @@ ACCT_PERCENT = 'mainForm:WO_ACCT_SINGLE_EDIT_content:subPercentValue'
 
 CONNECTION = 'DSN=fmax;UID=fmereports;PWD=fmerpts'
 
+# Work date as typed into the time card form
+DATE_FORMAT = '%b %d, %Y'
+# Seconds a warm browser is kept open after its last use
+IDLE_TIMEOUT = 15 * 60
+# Seconds each kind of step may take before it is given up on:
+#   page    = a page load
+#   element = an element to appear or become clickable
+#   login   = the NetID form to hand back to AiM
+#   detail  = a time card line to be accepted or rejected
+TIMEOUTS = {'page': 30.0, 'element': 10.0, 'login': 60.0, 'detail': 10.0}
+# Seconds between checks while waiting
+POLL_INTERVAL = 0.1
+# Encrypted AiM session cookies, and the keyring service holding their key
+COOKIE_FILE = os.path.join(os.path.expanduser('~'), '.timetrack_cookies')
+COOKIE_KEYRING = 'aim-cookies'
+
+# Steps of submitting a time card, as reported by Progress:
+#   skip     = the card was not sent, 'error' says why
+#   remove   = the lines no longer on the card are being removed
+#   change   = changed line 'line' of 'lines' is being retyped
+#   add      = new line 'line' of 'lines' is being typed
+#   rejected = AiM rejected line 'line', 'invalid' holds its workorder
+#   timeout  = AiM stopped answering, 'error' says where
+#   saved    = the card was saved, less any 'invalid' workorders
+SKIP = 'skip'
+REMOVE = 'remove'
+CHANGE = 'change'
+ADD = 'add'
+REJECTED = 'rejected'
+TIMEOUT = 'timeout'
+SAVED = 'saved'
+PROGRESS_MESSAGES = {
+    SKIP: 'Skipped: {error}',
+    REMOVE: 'Removing {lines} lines...',
+    CHANGE: 'Changing... {line}/{lines}',
+    ADD: 'Processing... {line}/{lines}',
+    REJECTED: 'Line {line} rejected, {invalid}: {error}',
+    TIMEOUT: '{error}',
+}
+
 
 def _locate_firefox_profile() -> str:
     home = os.path.expanduser('~')
@@ -103,29 +158,159 @@ def _locate_firefox_profile() -> str:
     return profile
 
 
+def timecard_entries(card) -> List[Tuple[str, ...]]:
+    "The rows new_timecard expects for a TimeCard, overhead entries last"
+    entries = [entry.values()[2:] for entry in card]
+    entries.sort(key=lambda e: e[0], reverse=True)
+    return entries
+
+
+class Progress(NamedTuple):
+    """
+    One step of submitting a time card, as yielded by new_timecard and
+    edit_timecard. str() gives the message shown to users.
+    """
+    step: str
+    line: int = 0
+    lines: int = 0
+    # seconds since the card was started
+    elapsed: float = 0.0
+    # workorders AiM rejected: the line's, or every one once SAVED
+    invalid: Tuple[str, ...] = ()
+    # AiM's message for a rejected line, or why the card was not sent
+    error: str = ''
+
+    @property
+    def failed(self) -> bool:
+        return bool(self.invalid) or self.step == TIMEOUT
+
+    def __str__(self) -> str:
+        invalid = ', '.join(self.invalid)
+        if self.step == SAVED:
+            if invalid:
+                return f'Error, invalid entries: {invalid} 🤬'
+            return 'Done! 😎'
+        return PROGRESS_MESSAGES[self.step].format(
+            line=self.line, lines=self.lines, invalid=invalid, error=self.error)
+
+
+class EditFailed(Exception):
+    "A saved time card could not be edited in place; nothing was saved"
+
+
+class SaveUnconfirmed(Exception):
+    """
+    Save was clicked but AiM never showed the time card saved, so it may
+    or may not have kept it. Sending the card again could duplicate it.
+    """
+
+
+class CookieJar:
+    """
+    AiM session cookies saved between runs, encrypted with a key kept in
+    keyring. Needs the optional cryptography package; without it, or
+    without a 'filename', nothing is saved and every new session logs in.
+    """
+
+    def __init__(self, netid: str, filename: Optional[str] = COOKIE_FILE) -> None:
+        self.netid = netid
+        self.filename = filename
+
+    def _fernet(self):
+        if self.filename is None:
+            return None
+        try:
+            from cryptography.fernet import Fernet
+        except ImportError:
+            return None
+        import keyring
+
+        key = keyring.get_password(COOKIE_KEYRING, self.netid)
+        if not key:
+            key = Fernet.generate_key().decode()
+            keyring.set_password(COOKIE_KEYRING, self.netid, key)
+        return Fernet(key.encode())
+
+    def load(self) -> List[Dict]:
+        "The saved cookies that have not expired; [] if there are none"
+        fernet = self._fernet()
+        if fernet is None:
+            return []
+        from cryptography.fernet import InvalidToken
+
+        try:
+            with open(self.filename, 'rb') as f:
+                jar = json.loads(fernet.decrypt(f.read()))
+        except (OSError, ValueError, InvalidToken):
+            return []
+        if jar.get('netid') != self.netid:
+            return []
+        now = time.time()
+        return [c for c in jar['cookies'] if c.get('expiry', now + 1) > now]
+
+    def save(self, cookies: List[Dict]) -> None:
+        fernet = self._fernet()
+        if fernet is None:
+            return
+        token = fernet.encrypt(
+            json.dumps({'netid': self.netid, 'cookies': cookies}).encode())
+        fd = os.open(self.filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with open(fd, 'wb') as f:
+            f.write(token)
+
+    def clear(self) -> None:
+        try:
+            os.remove(self.filename)
+        except (FileNotFoundError, TypeError):
+            pass
+
+
 class AimSession:
     """
     Wrapper class for a selenium webdriver object, tailored to
     interacting with the UW work management web app
     """
 
-    def __init__(self, *, netid: str, driver: Optional[webdriver.Remote] = None, debug: bool = False) -> None:
+    def __init__(self, *, netid: str, driver: Optional['webdriver.Remote'] = None, debug: bool = False,
+                 timeouts: Optional[Dict[str, float]] = None, base_url: str = AIM_BASE,
+                 password: Optional[str] = None,
+                 cookie_file: Optional[str] = COOKIE_FILE) -> None:
+        """
+        'base_url' points the session at another AiM, such as the training
+        site or a local stand-in. A given 'password' is used instead of the
+        one in keyring, and no cookies are kept without a 'cookie_file'.
+        """
 
         if driver is None:
+            from selenium import webdriver
             opt = webdriver.FirefoxOptions()
+            # the headless option of older selenium does nothing since 4.10
+            if not debug:
+                opt.add_argument('-headless')
+            opt.profile = webdriver.FirefoxProfile(_locate_firefox_profile())
             try:
-                opt.headless = not debug
-                opt.profile = webdriver.FirefoxProfile(
-                    _locate_firefox_profile())
-            except (AttributeError, TypeError):
-                opt.set_headless(not debug)
-            driver = webdriver.Firefox(
-                options=opt, service_log_path=os.devnull)
+                driver = webdriver.Firefox(
+                    options=opt, service_log_path=os.devnull)
+            except TypeError:
+                # selenium 4.10 moved the log option to the service
+                driver = webdriver.Firefox(
+                    options=opt,
+                    service=webdriver.FirefoxService(log_output=os.devnull))
 
         self.netid = netid
         self.shop = '17 ELECTRICAL'
+        self.base_url = base_url
+        self.password = password
+        self.cookies = CookieJar(netid, cookie_file)
+        self._restored = False
+        # of the last time card saved: (page, item number of each line added
+        # or None where AiM rejected it, items whose change was rejected)
+        self.last_saved: Tuple[str, List[Optional[int]], List[int]] = ('', [], [])
+        self.timeouts = {**TIMEOUTS, **(timeouts or {})}
         self.driver = driver
-        self.driver.implicitly_wait(20)
+        # every lookup waits explicitly, for as long as its step allows
+        self.driver.implicitly_wait(0)
+        self.driver.set_page_load_timeout(self.timeouts['page'])
 
     def __enter__(self):
         # self.login()
@@ -140,83 +325,392 @@ class AimSession:
 
     def login(self) -> None:
         "Login to AiM. "
-        counter = 0
-        password = keyring.get_password('aim', self.netid)
+        import keyring
+        from selenium.webdriver.common.keys import Keys
+
+        password = self.password or keyring.get_password('aim', self.netid)
         if not password:
             password = getpass.getpass()
             keyring.set_password('aim', self.netid, password)
-        if AIM_BASE not in self.driver.current_url:
-            self.driver.get(HOME_PAGE)
+        if 'NetID' not in self.driver.title:
+            # AiM sends the browser on to the NetID page
+            self.driver.get(self.url(HOME_PAGE))
         self.send_keys_to(UID, self.netid)
         self.send_keys_to(PWD, password)
         self.send_keys_to(PWD, Keys.RETURN)
-        while 'NetID' in self.driver.title:
-            time.sleep(1)
-            counter += 1
-            if counter == 60:
-                raise TimeoutError
+        self.wait_for(lambda driver: 'NetID' not in driver.title, 'login')
+        self.cookies.save(self.driver.get_cookies())
+
+    def restore_cookies(self) -> bool:
+        "Give the browser the cookies saved by the last login, if any"
+        cookies = self.cookies.load()
+        if not cookies:
+            return False
+        self.driver.get(urljoin(self.base_url, urlsplit(COOKIE_PAGE).path))
+        for cookie in cookies:
+            try:
+                self.driver.add_cookie(cookie)
+            except Exception:
+                pass
+        return True
 
-    def click(self, element_id: str) -> None:
-        self.driver.find_element(By.ID, element_id).click()
+    def ensure_login(self) -> None:
+        """
+        Open the AiM home page. A new session first tries the saved cookies,
+        and the full login is only done when AiM redirects to the NetID page.
+        Saved cookies that AiM no longer accepts are thrown away.
+        """
+        restored = False
+        if not self._restored:
+            self._restored = True
+            restored = self.restore_cookies()
+        self.driver.get(self.url(HOME_PAGE))
+        if 'NetID' in self.driver.title:
+            if restored:
+                self.cookies.clear()
+            self.login()
+
+    def url(self, page: str) -> str:
+        "One of the AiM page URLs above, on this session's AiM"
+        return self.base_url + page[len(AIM_BASE):] if page.startswith(AIM_BASE) else page
+
+    def healthy(self) -> bool:
+        "Whether the browser is still running and answering"
+        try:
+            self.driver.current_url
+            return True
+        except Exception:
+            return False
+
+    def wait_for(self, condition, step: str = 'element'):
+        """
+        Wait until 'condition(driver)' returns something true and return it.
+        Raises TimeoutError once the step's timeout has passed.
+        """
+        from selenium.common.exceptions import TimeoutException
+        from selenium.webdriver.support.ui import WebDriverWait
+
+        try:
+            return WebDriverWait(self.driver, self.timeouts[step],
+                                 POLL_INTERVAL).until(condition)
+        except TimeoutException:
+            raise TimeoutError(f'AiM {step} timed out') from None
+
+    def find(self, element_id: str, step: str = 'element'):
+        from selenium.webdriver.common.by import By
+        from selenium.webdriver.support import expected_conditions as EC
+
+        return self.wait_for(
+            EC.presence_of_element_located((By.ID, element_id)), step)
+
+    def click(self, element_id: str, step: str = 'element') -> None:
+        from selenium.webdriver.common.by import By
+        from selenium.webdriver.support import expected_conditions as EC
+
+        self.wait_for(
+            EC.element_to_be_clickable((By.ID, element_id)), step).click()
 
     def clear(self, element_id: str) -> None:
-        self.driver.find_element(By.ID, element_id).clear()
+        self.find(element_id).clear()
 
     def send_keys_to(self, element_id: str, keys: str) -> None:
-        self.driver.find_element(By.ID, element_id).send_keys(keys)
+        self.find(element_id).send_keys(keys)
 
-    def new_timecard(self, employee: str, date: str, entries: Iterable[str]) -> Iterable[str]:
+    def add_next_line(self) -> str:
+        """
+        Click TC_ADD_NEXT and wait until AiM either re-renders the detail
+        form for a new line or reports an error. Returns the error, or ''.
+        """
+        from selenium.common.exceptions import (NoSuchElementException,
+                                                StaleElementReferenceException)
+        from selenium.webdriver.common.by import By
 
-        self.get(AIM_TIMECARD)
-        self.click(NEW)
-        self.send_keys_to(TC_PERSON, employee)
-        self.send_keys_to(TC_DATE, date)
+        # hours are filled in on every line, leave or labour
+        line = self.find(TC_HOURS)
+        filled = bool(line.get_attribute('value'))
+        try:
+            shown = self.driver.find_element(By.ID, TC_ERROR_MSG)
+            if not shown.text:
+                shown = None
+        except NoSuchElementException:
+            shown = None
+        self.click(TC_ADD_NEXT)
+
+        def error_shown(driver) -> str:
+            if shown is not None:
+                # the previous line's error only counts once it is redrawn
+                try:
+                    shown.text
+                    return ''
+                except StaleElementReferenceException:
+                    pass
+            try:
+                return driver.find_element(By.ID, TC_ERROR_MSG).text
+            except (NoSuchElementException, StaleElementReferenceException):
+                return ''
+
+        def settled(driver):
+            error = error_shown(driver)
+            if error:
+                return (error,)
+            try:
+                if filled and not line.get_attribute('value'):
+                    return ('',)
+            except StaleElementReferenceException:
+                return ('',)
+            return None
+
+        return self.wait_for(settled, 'detail')[0]
+
+    def line_error(self) -> str:
+        """
+        After closing a detail form, wait until AiM either shows the time
+        card again or keeps the form open with an error. Returns the error.
+        """
+        from selenium.common.exceptions import (NoSuchElementException,
+                                                StaleElementReferenceException)
+        from selenium.webdriver.common.by import By
+
+        def settled(driver):
+            try:
+                error = driver.find_element(By.ID, TC_ERROR_MSG).text
+                if error:
+                    return (error,)
+            except (NoSuchElementException, StaleElementReferenceException):
+                pass
+            if driver.find_elements(By.ID, TC_ADD_FIRST):
+                return ('',)
+            return None
+
+        return self.wait_for(settled, 'detail')[0]
+
+    def fill_line(self, entry: Tuple[str, ...]) -> None:
+        "Type a (workorder, phase, hours, description, action, code) line"
+        workorder, phase, hours, description, action, code = entry
+        self.clear(TC_WORKORDER),
+        self.clear(TC_PHASE),
+        self.clear(TC_DECRIPTION),
+        self.clear(TC_ACTION),
+        self.clear(TC_HOURS),
+        self.clear(TC_LEAVE_CODE)
+        self.clear(TC_LABOR_CODE)
+
+        if code in ('S', 'A', 'PH', 'CT', 'HOLIDAY'):
+            self.send_keys_to(TC_LEAVE_CODE, code)
+        else:
+            self.send_keys_to(TC_LABOR_CODE, code)
+            self.send_keys_to(TC_WORKORDER, workorder)
+            self.send_keys_to(TC_PHASE, phase)
+            self.send_keys_to(TC_ACTION, action)
+        self.send_keys_to(TC_HOURS, hours)
+        self.send_keys_to(TC_DECRIPTION, description)
+
+    def item_number(self, default: int) -> int:
+        "The AiM item number of the line in the detail form"
+        value = self.find(TC_ITEM_NUM).get_attribute('value') or ''
+        return int(value) if value.strip().isdigit() else default
+
+    def cancel_line(self) -> None:
+        "Throw away the line in the detail form and go back to the time card"
+        self.click(CANCEL)
+        self.find(TC_ADD_FIRST)
+
+    def save(self) -> None:
+        """
+        Click SAVE and wait until AiM shows the time card saved. Raises
+        TimeoutError if the button never shows, and SaveUnconfirmed for
+        anything going wrong once it was clicked.
+        """
+        from selenium.webdriver.common.by import By
+        from selenium.webdriver.support import expected_conditions as EC
+
+        button = self.wait_for(EC.element_to_be_clickable((By.ID, SAVE)))
+        try:
+            button.click()
+            self.find(EDIT, 'page')
+        except Exception as e:
+            raise SaveUnconfirmed(f'AiM did not confirm the save: {e}') from e
+
+    def add_lines(self, entries: List[Tuple[str, ...]], first_item: int = 1,
+                  started: Optional[float] = None
+                  ) -> Generator[Progress, None, Tuple[List[str], List[Optional[int]]]]:
+        """
+        Add 'entries' as new lines of the time card being edited, then
+        close the detail form. Yields Progress, timed from 'started', and
+        returns the workorders AiM rejected and the item number of each
+        line added, None for the rejected ones.
+        """
+        started = time.perf_counter() if started is None else started
         self.click(TC_ADD_FIRST)
-        errors = []
+        errors, items = [], []
         for i, entry in enumerate(entries):
-            workorder, phase, hours, description, action, code = entry
-            yield f'Processing... {i+1}/{len(entries)}'
-            self.clear(TC_WORKORDER),
-            self.clear(TC_PHASE),
-            self.clear(TC_DECRIPTION),
-            self.clear(TC_ACTION),
-            self.clear(TC_HOURS),
-            self.clear(TC_LEAVE_CODE)
-            self.clear(TC_LABOR_CODE)
-
-            if code in ('S', 'A', 'PH', 'CT', 'HOLIDAY'):
-                self.send_keys_to(TC_LEAVE_CODE, code)
+            yield Progress(ADD, i + 1, len(entries), time.perf_counter() - started)
+            self.fill_line(entry)
+            item = self.item_number(first_item + i)
+            last = i == len(entries) - 1
+            if last:
+                self.click(DONE)
+                error = self.line_error()
             else:
-                self.send_keys_to(TC_LABOR_CODE, code)
-                self.send_keys_to(TC_WORKORDER, workorder)
-                self.send_keys_to(TC_PHASE, phase)
-                self.send_keys_to(TC_ACTION, action)
-            self.send_keys_to(TC_HOURS, hours)
-            self.send_keys_to(TC_DECRIPTION, description)
-            if i != len(entries) - 1:
-                self.click(TC_ADD_NEXT)
-                time.sleep(0.25)
-                error = self.find_element(By.ID, TC_ERROR_MSG).text
+                # a rejected line is typed over by the next one
+                error = self.add_next_line()
+            if error:
+                errors.append(entry[0])
+                yield Progress(REJECTED, i + 1, len(entries),
+                               time.perf_counter() - started, (entry[0],), error)
+                if last:
+                    self.cancel_line()
+            items.append(None if error else item)
+        return errors, items
+
+    def edit_timecard(self, url: str, changes: Dict[int, Tuple[str, ...]],
+                      adds: List[Tuple[str, ...]], removes: List[int],
+                      first_item: int = 1) -> Iterator[Progress]:
+        """
+        Bring the saved time card at 'url' up to date by only retyping the
+        lines in 'changes' ({item number: entry}), removing the 'removes'
+        items and adding 'adds' as new lines numbered from 'first_item'.
+        Raises EditFailed if the card could not be edited before saving,
+        except for a TimeoutError, which is left as it is.
+        """
+        started = time.perf_counter()
+        errors, rejected = [], []
+        try:
+            self.get(url)
+            self.click(EDIT)
+            if removes:
+                yield Progress(REMOVE, 0, len(removes), time.perf_counter() - started)
+                for item in removes:
+                    self.click(TC_LINE_SELECT.format(item))
+                self.click(TC_REMOVE)
+            for i, (item, entry) in enumerate(changes.items()):
+                yield Progress(CHANGE, i + 1, len(changes), time.perf_counter() - started)
+                self.click(TC_LINE.format(item))
+                if self.item_number(item) != item:
+                    raise ValueError(f'AiM opened the wrong line for item {item}')
+                self.fill_line(entry)
+                self.click(DONE)
+                error = self.line_error()
                 if error:
-                    errors.append(workorder)
-        self.click(DONE)
-        self.click(SAVE)
+                    errors.append(entry[0])
+                    rejected.append(item)
+                    yield Progress(REJECTED, i + 1, len(changes),
+                                   time.perf_counter() - started, (entry[0],), error)
+                    # AiM keeps the line as it was
+                    self.cancel_line()
+            items = []
+            if adds:
+                added, items = yield from self.add_lines(adds, first_item, started)
+                errors.extend(added)
+        except TimeoutError:
+            # AiM may only be slow, so the day is tried again as it is
+            raise
+        except Exception as e:
+            raise EditFailed(f'Could not edit {url}: {e}') from e
+        self.save()
+        self.last_saved = (url, items, rejected)
+        yield Progress(SAVED, elapsed=time.perf_counter() - started,
+                       invalid=tuple(errors))
 
-        if errors:
-            yield 'Error, invalid entries: {} 🤬'.format(', '.join(errors))
-        else:
-            yield 'Done! 😎'
-
-        def vacation(self, employee, dates):
-            self.get(RAPID_TIMECARD_EDIT)
-            self.send_keys_to(RTC_SHOP_PERSON, employee)
-            self.send_keys_to(RTC_LEAVE_CODE, 'A')
-            self.send_keys_to(RTC_HOURS)
-            for date in dates:
-                self.clear(RTC_WORK_DATE)
-                self.send_keys_to(RTC_WORK_DATE, date)
-                self.click(RTC_ADD)
-            self.click(RTC_SAVE)
+    def new_timecard(self, employee: str, date: str, entries: Iterable[str]) -> Iterator[Progress]:
+
+        started = time.perf_counter()
+        self.get(self.url(AIM_TIMECARD))
+        self.click(NEW)
+        self.send_keys_to(TC_PERSON, employee)
+        self.send_keys_to(TC_DATE, date)
+        errors, items = yield from self.add_lines(entries, started=started)
+        self.save()
+        self.last_saved = (self.driver.current_url, items, [])
+        yield Progress(SAVED, elapsed=time.perf_counter() - started,
+                       invalid=tuple(errors))
+
+    def vacation(self, employee: str, dates: Iterable[str], hours: str = '8',
+                 leave_code: str = 'A') -> None:
+        "Enter 'hours' of leave on each of 'dates' through the rapid time card"
+        self.get(self.url(RAPID_TIMECARD_EDIT))
+        self.send_keys_to(RTC_SHOP_PERSON, employee)
+        self.send_keys_to(RTC_LEAVE_CODE, leave_code)
+        self.send_keys_to(RTC_HOURS, hours)
+        for date in dates:
+            self.clear(RTC_WORK_DATE)
+            self.send_keys_to(RTC_WORK_DATE, date)
+            self.click(RTC_ADD)
+        self.click(RTC_SAVE)
+
+
+class SessionPool:
+    """
+    Keeps one logged in AimSession alive between submits, so only the first
+    submit pays for starting Firefox and logging in. The browser is checked
+    before each use, replaced if it died, logged in again if the SSO
+    session expired, and closed after 'idle_timeout' seconds without use.
+    """
+
+    def __init__(self, idle_timeout: float = IDLE_TIMEOUT) -> None:
+        self.idle_timeout = idle_timeout
+        self._lock = threading.Lock()
+        self._session: Optional[AimSession] = None
+        self._key = None
+        self._timer: Optional[threading.Timer] = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, ex_type, ex_val, ex_trace):
+        self.close()
+
+    @contextmanager
+    def session(self, netid: str, debug: bool = False) -> Iterator[AimSession]:
+        """
+        A logged in session for 'netid'. Submits are serialised, since they
+        share one browser. A session that fails while in use is discarded.
+        """
+        with self._lock:
+            self._cancel_timer()
+            if self._session is not None and (
+                    self._key != (netid, debug) or not self._session.healthy()):
+                self._discard()
+            if self._session is None:
+                self._session = AimSession(netid=netid, debug=debug)
+                self._key = (netid, debug)
+            try:
+                self._session.ensure_login()
+                yield self._session
+            except BaseException:
+                self._discard()
+                raise
+            finally:
+                if self._session is not None:
+                    self._timer = threading.Timer(self.idle_timeout, self._expire)
+                    self._timer.daemon = True
+                    self._timer.start()
+
+    def close(self) -> None:
+        with self._lock:
+            self._cancel_timer()
+            self._discard()
+
+    def _expire(self) -> None:
+        # skip if a submit is running; it restarts the timer when done
+        if self._lock.acquire(blocking=False):
+            try:
+                self._discard()
+            finally:
+                self._lock.release()
+
+    def _cancel_timer(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _discard(self) -> None:
+        session, self._session = self._session, None
+        if session is not None:
+            try:
+                session.driver.quit()
+            except Exception:
+                pass
 
 
 if __name__ == '__main__':
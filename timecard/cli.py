@@ -0,0 +1,368 @@
+"""
+Command line entry point. Without a command the full screen UI is started.
+"""
+import argparse
+import datetime
+import sqlite3
+import sys
+import time
+from typing import List, Optional
+
+from .config import CONFIG, crew, employee_id, load
+
+STARTED = time.perf_counter()
+
+# Modules are imported by the commands that need them, so that quick
+# commands such as 'show' never load selenium, keyring or asciimatics.
+
+RELATIVE_DAYS = {'yesterday': -1, 'today': 0, 'tomorrow': 1}
+
+
+def open_db(args: argparse.Namespace):
+    from .database import TimeCardDatabase
+
+    db = TimeCardDatabase(args.db or CONFIG['DEFAULT']['db_file'],
+                          prefetch=False)
+    db.employee = args.employee
+    return db
+
+
+def print_entry(entry, item: Optional[int] = None) -> None:
+    item = entry.line_item if item is None else item
+    print(f'{item:>3}  {entry.work_date}  {entry.workorder:>6} {entry.phase:>3}'
+          f'  {entry.hours:>5.2f}  {entry.time_code:<7} {entry.action:<6}'
+          f' {entry.description}')
+
+
+def cmd_show(args: argparse.Namespace) -> int:
+    with open_db(args) as db:
+        card = db.get_timecard(args.date)
+    for entry in card:
+        print_entry(entry)
+    hours = sum(entry.hours for entry in card)
+    print(f'{args.date:%a %b %d, %Y}: {len(card)} entries, {hours:g} hours')
+    return 0
+
+
+def cmd_add(args: argparse.Namespace) -> int:
+    from .transfer import normalise
+
+    entry, _ = normalise({
+        'work_date': args.date,
+        'workorder': args.workorder,
+        'phase': args.phase,
+        'hours': args.hours,
+        'description': args.description,
+        'action': args.action,
+        'time_code': args.code,
+    })
+    with open_db(args) as db:
+        entry.line_item = db.add_record(entry, on_conflict='append')
+    print_entry(entry)
+    return 0
+
+
+def cmd_search(args: argparse.Namespace) -> int:
+    with open_db(args) as db:
+        count = 0
+        for count, entry in enumerate(
+                db.iter_records(args.text, args.start, args.end), 1):
+            print_entry(entry, count)
+    print(f'{count} records found', file=sys.stderr)
+    return 0
+
+
+def cmd_submit(args: argparse.Namespace) -> int:
+    from .submit import FAILED, UNCONFIRMED
+
+    if args.queue:
+        return queue_cards(args)
+    with open_db(args) as db:
+        if args.crew:
+            employees = [''] + crew()
+        else:
+            employees = [db.employee]
+        span = (args.date, args.to or args.date)
+        # keyed by AiM employee ID, as AiM and the workers know them
+        ids = {employee_id(employee): employee for employee in employees}
+        cards = {aim_id: db.get_timecards(*span, employee)
+                 for aim_id, employee in ids.items()}
+        previous = {aim_id: db.get_submissions(*span, employee)
+                    for aim_id, employee in ids.items()}
+        if args.crew:
+            results = submit_crew_cards(args, cards, previous)
+        else:
+            (aim_id, days), = cards.items()
+            results = {aim_id: submit_own_cards(args, aim_id, days,
+                                                previous[aim_id])}
+        for aim_id, days in results.items():
+            for result in days:
+                if result.submission:
+                    db.save_submission(result.work_date, result.submission,
+                                       ids[aim_id])
+    return int(any(r.status in (FAILED, UNCONFIRMED)
+                   for days in results.values() for r in days))
+
+
+def submit_own_cards(args: argparse.Namespace, employee: str, cards,
+                     previous) -> list:
+    from .aim import AimSession
+    from .submit import FAILED, DayResult, submit_cards, summary
+
+    debug = CONFIG['DEFAULT']['debug'] == 'True'
+
+    def progress(work_date, event):
+        print(f'{work_date}: {event}')
+
+    with AimSession(netid=CONFIG['AIM']['NETID'], debug=debug) as aim:
+        # the session swallows errors on exit, so they are caught in here
+        try:
+            aim.ensure_login()
+            results = submit_cards(aim, employee, cards, args.force, progress,
+                                   previous, args.resubmit)
+        except Exception as e:
+            # the browser would not log in or answer
+            error = str(e) or type(e).__name__
+            print(f'AiM: {error}', file=sys.stderr)
+            results = [DayResult(work_date, FAILED, error)
+                       for work_date in sorted(cards)]
+    print(summary(results))
+    return results
+
+
+def submit_crew_cards(args: argparse.Namespace, cards, previous) -> dict:
+    from .submit import WORKERS, submit_crew, summary
+
+    def progress(employee, results):
+        for result in results:
+            print(f'{employee} {result.work_date}: {result.status} {result.message}')
+
+    results = submit_crew(CONFIG['AIM']['NETID'], cards, args.force,
+                          args.workers or WORKERS,
+                          CONFIG['DEFAULT']['debug'] == 'True', progress,
+                          previous, args.resubmit)
+    print(summary([r for days in results.values() for r in days]))
+    return results
+
+
+def queue_cards(args: argparse.Namespace) -> int:
+    "Put the days that are ready in the outbox, for 'outbox --send' or the UI"
+    from .submit import skip_reason
+
+    employees = [''] + crew() if args.crew else [args.employee]
+    with open_db(args) as db:
+        for employee in employees:
+            cards = db.get_timecards(args.date, args.to or args.date, employee)
+            ready = []
+            for work_date, card in cards.items():
+                reason = skip_reason(card, args.force)
+                if reason:
+                    print(f'{employee_id(employee)} {work_date}: skipped, {reason}')
+                else:
+                    ready.append(work_date)
+            db.queue_submissions(ready, args.force, employee)
+            print(f'{employee_id(employee)}: {len(ready)} days queued')
+    return 0
+
+
+def cmd_outbox(args: argparse.Namespace) -> int:
+    from .aim import SessionPool
+    from .submit import FAILED, PENDING, UNCONFIRMED, OutboxWorker
+
+    with open_db(args) as db:
+        if args.send:
+            db.expedite_submissions()
+
+            def progress(entry, message, status):
+                if entry is None:
+                    print(message)
+                elif status:
+                    print(f'{employee_id(entry.employee)} {entry.work_date}: '
+                          f'{status} {message}')
+
+            with SessionPool() as sessions:
+                results = OutboxWorker(db, sessions, progress).send_due()
+            return int(any(r.status in (FAILED, PENDING, UNCONFIRMED)
+                           for r in results))
+        entries = db.outbox()
+    for entry in entries:
+        print(f'{employee_id(entry.employee):<10} {entry.work_date}  '
+              f'{entry.status:<11} {entry.attempts:>2} tries  {entry.message}')
+    print(f'{len(entries)} days not submitted', file=sys.stderr)
+    return 0
+
+
+def cmd_import(args: argparse.Namespace) -> int:
+    from .transfer import import_file
+
+    with open_db(args) as db:
+        added, skipped = import_file(db, args.file, args.format)
+    print(f'{added} records imported, {skipped} already present')
+    return 0
+
+
+def cmd_export(args: argparse.Namespace) -> int:
+    from .transfer import export_records
+
+    with open_db(args) as db:
+        count = export_records(db, args.file, args.filter,
+                               args.start, args.end, args.format)
+    print(f'{count} records exported')
+    return 0
+
+
+def iso_date(value: str) -> datetime.date:
+    try:
+        return datetime.date.fromisoformat(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'not a YYYY-MM-DD date: {value!r}')
+
+
+def day(value: str) -> datetime.date:
+    "A YYYY-MM-DD date, or 'today', 'yesterday' or 'tomorrow'"
+    if value.lower() in RELATIVE_DAYS:
+        return (datetime.date.today()
+                + datetime.timedelta(days=RELATIVE_DAYS[value.lower()]))
+    return iso_date(value)
+
+
+def profile_startup() -> int:
+    """
+    Start the UI and quit as soon as the first frame is drawn, then report
+    where the startup time went and whether the AiM modules were loaded.
+    """
+    from asciimatics.exceptions import StopApplication
+
+    timings = [('config', time.perf_counter())]
+    from asciimatics.screen import Screen
+    timings.append(('import asciimatics', time.perf_counter()))
+    from . import tui_main
+    timings.append(('import tui_main', time.perf_counter()))
+
+    draw_next_frame = Screen.draw_next_frame
+
+    def first_frame(screen, *args, **kwargs):
+        draw_next_frame(screen, *args, **kwargs)
+        timings.append(('first frame', time.perf_counter()))
+        raise StopApplication('startup profiled')
+
+    Screen.draw_next_frame = first_frame
+    try:
+        tui_main.main()
+    except SystemExit:
+        pass
+    finally:
+        Screen.draw_next_frame = draw_next_frame
+
+    last = STARTED
+    for name, t in timings:
+        print(f'{name:<20}{(t - last) * 1000:8.1f} ms', file=sys.stderr)
+        last = t
+    print(f'{"total":<20}{(last - STARTED) * 1000:8.1f} ms', file=sys.stderr)
+    loaded = [m for m in ('selenium', 'keyring') if m in sys.modules]
+    print(f'{"loaded":<20}{", ".join(loaded) or "no AiM modules"}',
+          file=sys.stderr)
+    return 0
+
+
+def parser() -> argparse.ArgumentParser:
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--db', help='database file (default from ~/.timetrack)')
+    common.add_argument('--employee', default='',
+                        help='work on this crew member\'s time (default your own)')
+    dated = argparse.ArgumentParser(add_help=False)
+    dated.add_argument('date', nargs='?', type=day, default='today',
+                       help="work date: YYYY-MM-DD, 'today' (default), "
+                            "'yesterday' or 'tomorrow'")
+    ranged = argparse.ArgumentParser(add_help=False)
+    ranged.add_argument('--from', dest='start', type=iso_date,
+                        default=datetime.date(2019, 1, 1),
+                        help='first work date')
+    ranged.add_argument('--to', dest='end', type=iso_date,
+                        default=datetime.date.today(), help='last work date')
+
+    p = argparse.ArgumentParser(prog='timecard', description=__doc__)
+    p.add_argument('--profile-startup', action='store_true',
+                   help='time starting the UI up to its first frame, then quit')
+    commands = p.add_subparsers(dest='command', metavar='command')
+
+    c = commands.add_parser('show', parents=[common, dated],
+                            help="print a day's time card")
+    c.set_defaults(run=cmd_show)
+
+    c = commands.add_parser('add', parents=[common],
+                            help='add an entry to a time card')
+    c.add_argument('workorder')
+    c.add_argument('phase')
+    c.add_argument('hours', type=float)
+    c.add_argument('description', nargs='?', default='')
+    c.add_argument('--date', type=day, default='today',
+                   help="work date (default 'today')")
+    c.add_argument('--action', default='')
+    c.add_argument('--code', default='R', help='time code (default R)')
+    c.set_defaults(run=cmd_add)
+
+    c = commands.add_parser('search', parents=[common, ranged],
+                            help='print records matching some text')
+    c.add_argument('text', nargs='?', default='')
+    c.set_defaults(run=cmd_search)
+
+    c = commands.add_parser('submit', parents=[common, dated],
+                            help='submit a day, or a range of days, to AiM')
+    c.add_argument('--to', type=day,
+                   help='submit every day from DATE up to this one')
+    c.add_argument('--force', action='store_true',
+                   help='also submit days that do not total 8 hours')
+    c.add_argument('--resubmit', action='store_true',
+                   help='submit a day as a new card when its old card cannot '
+                        'be edited; delete the old card in AiM yourself')
+    c.add_argument('--crew', action='store_true',
+                   help='submit for you and every crew member, in parallel')
+    c.add_argument('--workers', type=int,
+                   help='most browsers used at once with --crew (default 4)')
+    c.add_argument('--queue', action='store_true',
+                   help='only add the days to the outbox, to be sent later')
+    c.set_defaults(run=cmd_submit)
+
+    c = commands.add_parser('outbox', parents=[common],
+                            help='list days queued for AiM, or send them')
+    c.add_argument('--send', action='store_true',
+                   help='send every queued day now, retries included')
+    c.set_defaults(run=cmd_outbox)
+
+    c = commands.add_parser('import', parents=[common],
+                            help='import CSV or JSON lines records')
+    c.add_argument('file')
+    c.add_argument('--format', choices=('csv', 'jsonl'),
+                   help='file format (default from the file extension)')
+    c.set_defaults(run=cmd_import)
+
+    c = commands.add_parser('export', parents=[common, ranged],
+                            help='export records as CSV, JSON lines or Parquet')
+    c.add_argument('file')
+    c.add_argument('--format', choices=('csv', 'jsonl', 'parquet'),
+                   help='file format (default from the file extension)')
+    c.add_argument('--filter', default='',
+                   help='only records matching this text, as in Search')
+    c.set_defaults(run=cmd_export)
+    return p
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parser().parse_args(argv)
+    load()
+    if args.profile_startup:
+        return profile_startup()
+    if args.command is None:
+        from .tui_main import main as tui
+        tui()
+        return 0
+    try:
+        return args.run(args)
+    except (OSError, ValueError, KeyError, sqlite3.Error) as e:
+        print(f'timecard {args.command}: {e}', file=sys.stderr)
+        return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
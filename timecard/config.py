@@ -0,0 +1,35 @@
+import os
+from configparser import ConfigParser
+from typing import List
+
+CONFIG = ConfigParser()
+CONFIG_FILE = os.path.join(os.path.expanduser('~'), '.timetrack')
+
+
+def init():
+    CONFIG['DEFAULT']['db_file'] = os.path.join(
+        os.path.expanduser('~'), 'Documents', 'time_cards.db')
+    CONFIG['DEFAULT']['theme'] = 'bright'
+    CONFIG['DEFAULT']['debug'] = ''
+    CONFIG['AIM'] = {'EMPLOYEE_ID': '', 'NETID': '', 'CREW': ''}
+    with open(CONFIG_FILE, 'w') as f:
+        CONFIG.write(f)
+
+
+def load() -> ConfigParser:
+    "Read the config file, writing the defaults on first run"
+    if os.path.exists(CONFIG_FILE):
+        CONFIG.read(CONFIG_FILE)
+    else:
+        init()
+    return CONFIG
+
+
+def crew() -> List[str]:
+    "Employee IDs of the crew whose time is also kept, from AIM/CREW"
+    return CONFIG['AIM'].get('CREW', '').replace(',', ' ').split()
+
+
+def employee_id(employee: str) -> str:
+    "The AiM employee ID of a database employee; '' is the owner"
+    return employee or CONFIG['AIM']['EMPLOYEE_ID']
@@ -1,15 +1,51 @@
 # import datetime
+import json
 import os
+import queue
+import re
 import sqlite3
-from dataclasses import dataclass, asdict
-from datetime import date
-from typing import Any, Tuple, Optional, List, Union
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import date, timedelta
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    Literal,
+    Tuple,
+    Optional,
+    List,
+    Set,
+    Union,
+)
 
 # Files and Folders
 HOME = os.path.expanduser("~")
 WORK = os.path.join(HOME, "OneDrive - UW", "Work")
 DB_FILE = "time_cards.db"
 
+# Connection tuning
+STATEMENT_CACHE_SIZE = 64
+BUSY_TIMEOUT = 5.0
+PAGE_CACHE_KIB = 16384
+# Batches at least this large are full text indexed in one statement
+BULK_THRESHOLD = 1000
+# SQLite VM instructions between checks for a cancelled query
+PROGRESS_STEPS = 1000
+# Rows fetched per page when streaming search results
+PAGE_SIZE = 200
+# Time cards kept in memory, and the days around a viewed card to prefetch
+CACHE_SIZE = 64
+PREFETCH_DAYS = (-1, 1, -7, 7)
+
+# Word characters, as split by the FTS5 unicode61 tokenizer
+_WORD = re.compile(r"[^\W_]+")
+
 
 @dataclass(slots=True)
 class TimeCardEntry:
@@ -21,6 +57,8 @@ class TimeCardEntry:
     description: str = ""
     action: str = ""
     time_code: str = "R"
+    # None until stored: the database's current employee is used
+    employee: Optional[str] = None
 
     def __getitem__(self, key: str) -> Any:
         return self.__getattribute__(key)
@@ -44,7 +82,31 @@ class TimeCardEntry:
         return self.__slots__
 
     def dict(self) -> dict:
-        return asdict(self)
+        # all fields are immutable, so skip asdict()'s deep copy
+        return {key: self.__getattribute__(key) for key in self.__slots__}
+
+
+@dataclass(frozen=True)
+class OutboxEntry:
+    "A day of one employee's time queued for submission to AiM"
+    id: int
+    employee: str
+    work_date: date
+    force: bool
+    status: str
+    attempts: int
+    next_attempt: float
+    message: str
+
+
+@dataclass(frozen=True)
+class Submission:
+    """
+    What was last sent to AiM for a card: the page of the saved AiM time
+    card, and a fingerprint of each of its lines by AiM item number
+    """
+    url: str
+    lines: Dict[int, str]
 
 
 class TimeCard:
@@ -68,6 +130,400 @@ class TimeCard:
         return sum(entry["hours"] for entry in self.entries)
 
 
+def _entry(record: Union[TimeCardEntry, dict]) -> TimeCardEntry:
+    return TimeCardEntry(**record) if isinstance(record, dict) else record
+
+
+def _outbox_entry(row: tuple) -> OutboxEntry:
+    entry_id, employee, work_date, force, *rest = row
+    return OutboxEntry(entry_id, employee, work_date, bool(force), *rest)
+
+
+ConflictPolicy = Literal["ignore", "replace", "append"]
+
+_OUTBOX_COLUMNS = (
+    "id, employee, work_date, force, status, attempts, next_attempt, message"
+)
+
+_INSERT = """
+    INSERT INTO records(work_date, line_item, workorder, phase, hours, description, action, time_code, employee)
+    VALUES(:work_date, {line_item}, :workorder, :phase, :hours, :description, :action, :time_code, :employee)
+    {on_conflict}
+"""
+_UPSERT = {
+    "ignore": _INSERT.format(
+        line_item=":line_item",
+        on_conflict="ON CONFLICT (employee, work_date, line_item) DO NOTHING",
+    ),
+    "replace": _INSERT.format(
+        line_item=":line_item",
+        on_conflict="""ON CONFLICT (employee, work_date, line_item) DO UPDATE SET
+        workorder=excluded.workorder, phase=excluded.phase, hours=excluded.hours,
+        description=excluded.description, action=excluded.action,
+        time_code=excluded.time_code""",
+    ),
+    "append": _INSERT.format(
+        line_item="""CASE WHEN EXISTS (
+            SELECT 1 FROM records WHERE employee=:employee
+            AND work_date=:work_date AND line_item=:line_item)
+        THEN (SELECT MAX(line_item) + 1 FROM records
+            WHERE employee=:employee AND work_date=:work_date)
+        ELSE :line_item END""",
+        on_conflict="",
+    ),
+}
+
+
+def _table_exists(db: sqlite3.Connection, name: str) -> bool:
+    sql = "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?"
+    return db.execute(sql, (name,)).fetchone() is not None
+
+
+def _migrate_v1(db: sqlite3.Connection) -> None:
+    """
+    Key records on (work_date, line_item) and index workorders.
+    The primary key index also serves lookups by work_date alone.
+    Legacy rows without a work date cannot be keyed and are dropped.
+    """
+    legacy = _table_exists(db, "records")
+    if legacy:
+        db.execute("ALTER TABLE records RENAME TO records_v0")
+    db.execute(
+        """
+        CREATE TABLE records
+        ( work_date DATE NOT NULL,
+        line_item INTEGER NOT NULL,
+        workorder TEXT,
+        phase TEXT,
+        hours REAL,
+        description TEXT,
+        action TEXT,
+        time_code TEXT,
+        PRIMARY KEY (work_date, line_item) )
+        """
+    )
+    if legacy:
+        # legacy rows were never unique, so each day is renumbered in line
+        # order to keep duplicates and rows without a line item
+        db.execute(
+            """
+            INSERT INTO records
+            SELECT work_date,
+            ROW_NUMBER() OVER (PARTITION BY work_date
+                ORDER BY line_item IS NULL, line_item, rowid) - 1,
+            workorder, phase, hours, description, action, time_code
+            FROM records_v0 WHERE work_date IS NOT NULL
+            """
+        )
+        db.execute("DROP TABLE records_v0")
+    db.execute("CREATE INDEX records_workorder ON records (workorder, phase)")
+
+
+def _migrate_v2(db: sqlite3.Connection) -> None:
+    """
+    Full text index over description, workorder and action, kept in
+    sync by triggers. Skipped when SQLite is built without FTS5.
+    """
+    try:
+        db.execute(
+            """
+            CREATE VIRTUAL TABLE records_fts USING fts5(
+                description, workorder, action,
+                content='records', content_rowid='rowid', prefix='2 3')
+            """
+        )
+    except sqlite3.OperationalError:
+        return
+    db.execute(
+        """
+        CREATE TRIGGER records_fts_insert AFTER INSERT ON records BEGIN
+            INSERT INTO records_fts(rowid, description, workorder, action)
+            VALUES (new.rowid, new.description, new.workorder, new.action);
+        END
+        """
+    )
+    db.execute(
+        """
+        CREATE TRIGGER records_fts_delete AFTER DELETE ON records BEGIN
+            INSERT INTO records_fts(records_fts, rowid, description, workorder, action)
+            VALUES ('delete', old.rowid, old.description, old.workorder, old.action);
+        END
+        """
+    )
+    db.execute(
+        """
+        CREATE TRIGGER records_fts_update
+        AFTER UPDATE OF description, workorder, action ON records BEGIN
+            INSERT INTO records_fts(records_fts, rowid, description, workorder, action)
+            VALUES ('delete', old.rowid, old.description, old.workorder, old.action);
+            INSERT INTO records_fts(rowid, description, workorder, action)
+            VALUES (new.rowid, new.description, new.workorder, new.action);
+        END
+        """
+    )
+    db.execute("INSERT INTO records_fts(records_fts) VALUES ('rebuild')")
+
+
+def _rollup_sql(rollups: Dict[str, Tuple[str, str, str]], table: str, row: str, sign: str) -> str:
+    "Apply one row of records to a rollup table, adding or subtracting its hours"
+    _, keys, values = rollups[table]
+    return f"""
+        INSERT INTO {table}({keys}, hours)
+        VALUES ({values.format(row=row)}, {sign}COALESCE({row}.hours, 0))
+        ON CONFLICT ({keys}) DO UPDATE SET hours = hours + excluded.hours;
+    """
+
+
+def _create_rollups(
+    db: sqlite3.Connection, rollups: Dict[str, Tuple[str, str, str]], update_of: str
+) -> None:
+    """
+    Create and fill each rollup table, given as
+    {table: (column definitions, key columns, key values from {row})},
+    and the triggers on records that keep them up to date. 'update_of'
+    lists the columns of records the rollups depend on.
+    """
+    for table, (columns, keys, values) in rollups.items():
+        db.execute(
+            f"""
+            CREATE TABLE {table} ( {columns}, hours REAL NOT NULL,
+            PRIMARY KEY ({keys}) ) WITHOUT ROWID
+            """
+        )
+        db.execute(
+            f"""
+            INSERT INTO {table}({keys}, hours)
+            SELECT {values.format(row="records")}, SUM(COALESCE(hours, 0))
+            FROM records GROUP BY {", ".join(map(str, range(1, keys.count(",") + 2)))}
+            """
+        )
+    db.execute(
+        f"""
+        CREATE TRIGGER rollup_insert AFTER INSERT ON records BEGIN
+            {"".join(_rollup_sql(rollups, table, "new", "") for table in rollups)}
+        END
+        """
+    )
+    db.execute(
+        f"""
+        CREATE TRIGGER rollup_delete AFTER DELETE ON records BEGIN
+            {"".join(_rollup_sql(rollups, table, "old", "-") for table in rollups)}
+        END
+        """
+    )
+    db.execute(
+        f"""
+        CREATE TRIGGER rollup_update
+        AFTER UPDATE OF {update_of} ON records BEGIN
+            {"".join(_rollup_sql(rollups, table, "old", "-") for table in rollups)}
+            {"".join(_rollup_sql(rollups, table, "new", "") for table in rollups)}
+        END
+        """
+    )
+
+
+def _migrate_v3(db: sqlite3.Connection) -> None:
+    """
+    Summary tables of hours by day, by week (starting Monday) and by
+    year and workorder/phase, each split by time_code. Triggers on
+    records apply every change to them as a delta.
+    """
+    _create_rollups(
+        db,
+        {
+            "hours_daily": (
+                "work_date DATE NOT NULL, time_code TEXT NOT NULL",
+                "work_date, time_code",
+                "{row}.work_date, COALESCE({row}.time_code, '')",
+            ),
+            "hours_weekly": (
+                "week DATE NOT NULL, time_code TEXT NOT NULL",
+                "week, time_code",
+                "date({row}.work_date, '-6 days', 'weekday 1'), COALESCE({row}.time_code, '')",
+            ),
+            "hours_workorder": (
+                "year INTEGER NOT NULL, workorder TEXT NOT NULL, phase TEXT NOT NULL, "
+                "time_code TEXT NOT NULL",
+                "year, workorder, phase, time_code",
+                "CAST(strftime('%Y', {row}.work_date) AS INTEGER), "
+                "COALESCE({row}.workorder, ''), COALESCE({row}.phase, ''), "
+                "COALESCE({row}.time_code, '')",
+            ),
+        },
+        "work_date, workorder, phase, hours, time_code",
+    )
+
+
+def _migrate_v4(db: sqlite3.Connection) -> None:
+    """
+    Add the employee a record belongs to, '' for the database's owner,
+    to the key of records and of the rollup tables. Rowids are kept, so
+    the full text index stays valid and only its triggers are recreated.
+    """
+    sql = "SELECT sql FROM sqlite_master WHERE type='trigger' AND name LIKE 'records_fts_%'"
+    fts_triggers = [trigger for (trigger,) in db.execute(sql)]
+    db.execute(
+        """
+        CREATE TABLE records_v4
+        ( work_date DATE NOT NULL,
+        line_item INTEGER NOT NULL,
+        workorder TEXT,
+        phase TEXT,
+        hours REAL,
+        description TEXT,
+        action TEXT,
+        time_code TEXT,
+        employee TEXT NOT NULL DEFAULT '',
+        PRIMARY KEY (employee, work_date, line_item) )
+        """
+    )
+    db.execute(
+        """
+        INSERT INTO records_v4(rowid, work_date, line_item, workorder, phase, hours,
+            description, action, time_code)
+        SELECT rowid, work_date, line_item, workorder, phase, hours,
+            description, action, time_code FROM records
+        """
+    )
+    db.execute("DROP TABLE records")
+    db.execute("ALTER TABLE records_v4 RENAME TO records")
+    db.execute("CREATE INDEX records_workorder ON records (workorder, phase)")
+    for trigger in fts_triggers:
+        db.execute(trigger)
+    for table in ("hours_daily", "hours_weekly", "hours_workorder"):
+        db.execute(f"DROP TABLE {table}")
+    _create_rollups(
+        db,
+        {
+            "hours_daily": (
+                "employee TEXT NOT NULL, work_date DATE NOT NULL, time_code TEXT NOT NULL",
+                "employee, work_date, time_code",
+                "{row}.employee, {row}.work_date, COALESCE({row}.time_code, '')",
+            ),
+            "hours_weekly": (
+                "employee TEXT NOT NULL, week DATE NOT NULL, time_code TEXT NOT NULL",
+                "employee, week, time_code",
+                "{row}.employee, date({row}.work_date, '-6 days', 'weekday 1'), "
+                "COALESCE({row}.time_code, '')",
+            ),
+            "hours_workorder": (
+                "employee TEXT NOT NULL, year INTEGER NOT NULL, workorder TEXT NOT NULL, "
+                "phase TEXT NOT NULL, time_code TEXT NOT NULL",
+                "employee, year, workorder, phase, time_code",
+                "{row}.employee, CAST(strftime('%Y', {row}.work_date) AS INTEGER), "
+                "COALESCE({row}.workorder, ''), COALESCE({row}.phase, ''), "
+                "COALESCE({row}.time_code, '')",
+            ),
+        },
+        "work_date, workorder, phase, hours, time_code, employee",
+    )
+
+
+def _migrate_v5(db: sqlite3.Connection) -> None:
+    """
+    Outbox of days queued for submission to AiM. Each row is pending
+    (or being sent) until it is submitted, skipped or fails for good,
+    or is unconfirmed when AiM may have saved it without showing so;
+    at most one per day is unfinished. next_attempt is a Unix time.
+    """
+    db.execute(
+        """
+        CREATE TABLE outbox
+        ( id INTEGER PRIMARY KEY,
+        employee TEXT NOT NULL,
+        work_date DATE NOT NULL,
+        force INTEGER NOT NULL DEFAULT 0,
+        status TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt REAL NOT NULL,
+        message TEXT NOT NULL DEFAULT '' )
+        """
+    )
+    db.execute(
+        """
+        CREATE UNIQUE INDEX outbox_unfinished ON outbox (employee, work_date)
+        WHERE status IN ('pending', 'sending')
+        """
+    )
+    db.execute("CREATE INDEX outbox_due ON outbox (status, next_attempt)")
+
+
+def _migrate_v6(db: sqlite3.Connection) -> None:
+    """
+    The AiM time card each card was last submitted as, and a fingerprint
+    of every line sent, so a re-submit only has to send what changed.
+    """
+    db.execute(
+        """
+        CREATE TABLE submitted_cards
+        ( employee TEXT NOT NULL,
+        work_date DATE NOT NULL,
+        url TEXT NOT NULL,
+        PRIMARY KEY (employee, work_date) ) WITHOUT ROWID
+        """
+    )
+    db.execute(
+        """
+        CREATE TABLE submitted_lines
+        ( employee TEXT NOT NULL,
+        work_date DATE NOT NULL,
+        aim_item INTEGER NOT NULL,
+        fingerprint TEXT NOT NULL,
+        PRIMARY KEY (employee, work_date, aim_item) ) WITHOUT ROWID
+        """
+    )
+
+
+def _migrate_v7(db: sqlite3.Connection) -> None:
+    """
+    Key the workorder rollup by day rather than year, so it can be summed
+    over any date range. The triggers apply to every rollup, so all of
+    them are rebuilt.
+    """
+    for trigger in ("rollup_insert", "rollup_delete", "rollup_update"):
+        db.execute(f"DROP TRIGGER {trigger}")
+    for table in ("hours_daily", "hours_weekly", "hours_workorder"):
+        db.execute(f"DROP TABLE {table}")
+    _create_rollups(
+        db,
+        {
+            "hours_daily": (
+                "employee TEXT NOT NULL, work_date DATE NOT NULL, time_code TEXT NOT NULL",
+                "employee, work_date, time_code",
+                "{row}.employee, {row}.work_date, COALESCE({row}.time_code, '')",
+            ),
+            "hours_weekly": (
+                "employee TEXT NOT NULL, week DATE NOT NULL, time_code TEXT NOT NULL",
+                "employee, week, time_code",
+                "{row}.employee, date({row}.work_date, '-6 days', 'weekday 1'), "
+                "COALESCE({row}.time_code, '')",
+            ),
+            "hours_workorder": (
+                "employee TEXT NOT NULL, work_date DATE NOT NULL, workorder TEXT NOT NULL, "
+                "phase TEXT NOT NULL, time_code TEXT NOT NULL",
+                "employee, work_date, workorder, phase, time_code",
+                "{row}.employee, {row}.work_date, "
+                "COALESCE({row}.workorder, ''), COALESCE({row}.phase, ''), "
+                "COALESCE({row}.time_code, '')",
+            ),
+        },
+        "work_date, workorder, phase, hours, time_code, employee",
+    )
+
+
+# Schema migrations, indexed by the user_version they upgrade from
+MIGRATIONS = (
+    _migrate_v1,
+    _migrate_v2,
+    _migrate_v3,
+    _migrate_v4,
+    _migrate_v5,
+    _migrate_v6,
+    _migrate_v7,
+)
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
 class TimeCardDatabase:
     """
     A database object for storing Time Card information, built
@@ -81,31 +537,118 @@ class TimeCardDatabase:
         description = str
         action = str (one of [WORK COMPLETE, ACTIVE/ONGOING, INITIAL RESPOND, OVERHEAD])
         time_code = str (one of [R, CP, OT, A, S, PH, HOLIDAY])
+        employee = str (AiM employee ID, '' for the database's owner)
+
+    Reads, searches, reports and the (work_date, line_item) methods work
+    on the cards of 'employee', which defaults to the owner. Records
+    added or updated are stored under their own employee, or under
+    'employee' when theirs is None.
+
+    Each thread gets its own long-lived connection, opened on first use
+    and kept until close() is called (or the database is used as a
+    context manager). Changing dbfilename closes all open connections.
+
+    Time cards read with get_timecard are kept in an LRU cache of
+    'cache_size' days, invalidated by every write through this object
+    and cleared when another connection changes the file. When
+    'prefetch' is set, the days around each card read are loaded into
+    the cache by a background thread.
+
+    Days queued with queue_submissions wait in the outbox table, shared
+    by all employees, until a sender claims and finishes them.
     """
 
-    def __init__(self, filename: str = os.path.join(WORK, DB_FILE)) -> None:
-        self.dbfilename = filename
+    def __init__(
+        self,
+        filename: str = os.path.join(WORK, DB_FILE),
+        cache_size: int = CACHE_SIZE,
+        prefetch: bool = True,
+    ) -> None:
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._connections: Dict[int, Tuple[threading.Thread, sqlite3.Connection]] = {}
+        self._generation = 0
+        self._cache: "OrderedDict[date, List[tuple]]" = OrderedDict()
+        self._cache_size = cache_size
+        self._cache_epoch = 0
+        self._prefetch = prefetch
+        self._prefetch_queue: "queue.Queue[Optional[date]]" = queue.Queue()
+        self._prefetch_thread: Optional[threading.Thread] = None
+        self._dbfilename = filename
+        self._employee = ""
         self.current_view = TimeCard()
         self.active_record = None
+        self._create_schema()
+
+    def __enter__(self) -> "TimeCardDatabase":
+        return self
+
+    def __exit__(self, ex_type, ex_val, ex_trace) -> None:
+        self.close()
+
+    @property
+    def dbfilename(self) -> str:
+        return self._dbfilename
+
+    @dbfilename.setter
+    def dbfilename(self, filename: str) -> None:
+        if filename == self._dbfilename:
+            return
+        self.close()
+        self._dbfilename = filename
+        self._create_schema()
+
+    @property
+    def employee(self) -> str:
+        return self._employee
+
+    @employee.setter
+    def employee(self, employee: str) -> None:
+        if employee != self._employee:
+            self._employee = employee
+            self._invalidate()
+
+    def _params(self, record: TimeCardEntry) -> dict:
+        "A record as named parameters, stored under 'employee' if it has none"
+        params = record.dict()
+        if params["employee"] is None:
+            params["employee"] = self._employee
+        return params
+
+    def close(self) -> None:
+        "Close every connection opened by any thread"
+        with self._lock:
+            connections = [conn for _, conn in self._connections.values()]
+            self._connections.clear()
+            self._generation += 1
+            thread, self._prefetch_thread = self._prefetch_thread, None
+            if thread:
+                self._prefetch_queue.put(None)
+                self._prefetch_queue = queue.Queue()
+        self._invalidate()
+        for conn in connections:
+            conn.close()
+
+    def _create_schema(self) -> None:
+        """
+        Bring the database file up to SCHEMA_VERSION, applying any
+        pending migrations in a single transaction.
+        """
         with self._connect() as db:
-            db.execute(
-                """
-                CREATE TABLE IF NOT EXISTS records
-                ( work_date DATE,
-                line_item INTEGER,
-                workorder TEXT,
-                phase TEXT,
-                hours REAL,
-                description TEXT,
-                action TEXT,
-                time_code TEXT )
-                """
-            )
+            db.execute("BEGIN IMMEDIATE")
+            (version,) = db.execute("PRAGMA user_version").fetchone()
+            for migrate in MIGRATIONS[version:]:
+                migrate(db)
+            db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            self._fts = _table_exists(db, "records_fts")
+        if version < SCHEMA_VERSION:
+            with self._connect() as db:
+                db.execute("ANALYZE")
 
     def get_record(self, work_date: date, item: int) -> Optional[TimeCardEntry]:
-        sql = "SELECT * FROM records WHERE work_date=? AND line_item=?"
+        sql = "SELECT * FROM records WHERE employee=? AND work_date=? AND line_item=?"
         with self._connect() as db:
-            c = db.execute(sql, (work_date, item))
+            c = db.execute(sql, (self._employee, work_date, item))
             record = c.fetchone()
             if record:
                 return TimeCardEntry(*record)
@@ -116,97 +659,716 @@ class TimeCardDatabase:
         if isinstance(record, (dict)):
             record = TimeCardEntry(**record)
         sql = """
-                UPDATE records SET workorder=?, phase=?, hours=?, description=?, action=?, time_code=?
-                WHERE work_date=? AND line_item=?
+                UPDATE records SET workorder=:workorder, phase=:phase, hours=:hours,
+                description=:description, action=:action, time_code=:time_code
+                WHERE employee=:employee AND work_date=:work_date AND line_item=:line_item
                 """
-        values = (
-            record.workorder,
-            record.phase,
-            record.hours,
-            record.description,
-            record.action,
-            record.time_code,
-            record.work_date,
-            record.line_item,
-        )
         with self._connect() as db:
-            db.execute(sql, values)
+            db.execute(sql, self._params(record))
+        self._invalidate(record.work_date)
 
-    def add_record(self, record: Union[TimeCardEntry, dict]) -> None:
+    def add_record(
+        self, record: Union[TimeCardEntry, dict], on_conflict: ConflictPolicy = "ignore"
+    ) -> Optional[int]:
+        """
+        Insert a record in a single statement. If its (work_date, line_item)
+        is already taken, 'on_conflict' decides what happens:
+            ignore  = keep the existing record
+            replace = overwrite the existing record
+            append  = store the new record as the card's next line item
+        Returns the line item the record was stored under, or None if
+        it was ignored.
+        """
         if isinstance(record, (dict)):
             record = TimeCardEntry(**record)
-        if not self.get_record(record.work_date, record.line_item):
-            with self._connect() as db:
-                sql = """
-                INSERT INTO records(work_date, line_item, workorder, phase, hours, description, action, time_code)
-                VALUES(?,?,?,?,?,?,?,?)
-                """
-                values = (
-                    record.work_date,
-                    record.line_item,
-                    record.workorder,
-                    record.phase,
-                    record.hours,
-                    record.description,
-                    record.action,
-                    record.time_code,
-                )
-                db.execute(sql, values)
+        try:
+            sql = _UPSERT[on_conflict]
+        except KeyError:
+            raise ValueError(f"unknown conflict policy: {on_conflict!r}") from None
+        with self._connect() as db:
+            row = db.execute(sql + "RETURNING line_item", self._params(record)).fetchone()
+        self._invalidate(record.work_date)
+        return row[0] if row else None
+
+    def add_records(
+        self,
+        records: Iterable[Union[TimeCardEntry, dict]],
+        on_conflict: ConflictPolicy = "ignore",
+    ) -> List[TimeCardEntry]:
+        """
+        Insert many records in one transaction with executemany.
+        Conflicts are handled as in add_record. Returns the records whose
+        (employee, work_date, line_item) was already taken, in the database
+        or by an earlier record in 'records'.
+        """
+        records = [_entry(record) for record in records]
+        try:
+            sql = _UPSERT[on_conflict]
+        except KeyError:
+            raise ValueError(f"unknown conflict policy: {on_conflict!r}") from None
+        if not records:
+            return []
+        params = [self._params(record) for record in records]
+        with self._connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            taken = self._existing_keys(db, params)
+            conflicts = []
+            for record, row in zip(records, params):
+                key = (row["employee"], row["work_date"], row["line_item"])
+                if key in taken:
+                    conflicts.append(record)
+                taken.add(key)
+            # inserts never touch existing index entries, so large batches
+            # can be indexed in one statement instead of row by row
+            bulk = on_conflict != "replace" and len(records) >= BULK_THRESHOLD
+            with self._deferred_fts(db, bulk):
+                db.executemany(sql, params)
+        self._invalidate(*{record.work_date for record in records})
+        return conflicts
+
+    @contextmanager
+    def _deferred_fts(self, db: sqlite3.Connection, defer: bool) -> Iterator[None]:
+        """
+        Inside a transaction, suspend the full text insert trigger and
+        index every row inserted in the block with one INSERT ... SELECT.
+        """
+        if not (defer and self._fts):
+            yield
+            return
+        sql = "SELECT sql FROM sqlite_master WHERE type='trigger' AND name=?"
+        (trigger,) = db.execute(sql, ("records_fts_insert",)).fetchone()
+        (last,) = db.execute("SELECT COALESCE(MAX(rowid), 0) FROM records").fetchone()
+        db.execute("DROP TRIGGER records_fts_insert")
+        yield
+        db.execute(
+            """
+            INSERT INTO records_fts(rowid, description, workorder, action)
+            SELECT rowid, description, workorder, action FROM records WHERE rowid > ?
+            """,
+            (last,),
+        )
+        db.execute(trigger)
+
+    def update_records(
+        self, records: Iterable[Union[TimeCardEntry, dict]]
+    ) -> List[TimeCardEntry]:
+        """
+        Update many records in one transaction with executemany.
+        Returns the records that did not exist and were skipped.
+        """
+        records = [_entry(record) for record in records]
+        if not records:
+            return []
+        sql = """
+        UPDATE records SET workorder=:workorder, phase=:phase, hours=:hours,
+        description=:description, action=:action, time_code=:time_code
+        WHERE employee=:employee AND work_date=:work_date AND line_item=:line_item
+        """
+        params = [self._params(record) for record in records]
+        with self._connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            taken = self._existing_keys(db, params)
+            db.executemany(sql, params)
+        self._invalidate(*{record.work_date for record in records})
+        return [
+            record
+            for record, row in zip(records, params)
+            if (row["employee"], row["work_date"], row["line_item"]) not in taken
+        ]
+
+    def delete_records(
+        self, keys: Iterable[Tuple[date, int]]
+    ) -> List[Tuple[date, int]]:
+        """
+        Remove many (work_date, line_item) records of 'employee' in one
+        transaction.
+        Line item numbers of each affected day will be adjusted.
+        Returns the keys that did not exist.
+        """
+        keys = list(keys)
+        if not keys:
+            return []
+        dates = sorted({work_date for work_date, _ in keys})
+        employee = self._employee
+        with self._connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            sql = """
+            SELECT work_date, line_item FROM records
+            WHERE employee=? AND work_date BETWEEN ? AND ?
+            """
+            taken = set(db.execute(sql, (employee, dates[0], dates[-1])))
+            db.executemany(
+                "DELETE FROM records WHERE employee=? AND work_date=? AND line_item=?",
+                ((employee, *key) for key in keys),
+            )
+            # renumber what is left of each day from 0, parked as in _settle
+            sql = """
+            SELECT rowid FROM records WHERE employee=? AND work_date=?
+            ORDER BY line_item
+            """
+            moves = [
+                (-1 - n, rowid)
+                for work_date in dates
+                for n, (rowid,) in enumerate(db.execute(sql, (employee, work_date)))
+            ]
+            db.executemany("UPDATE records SET line_item=? WHERE rowid=?", moves)
+            for work_date in dates:
+                self._settle(db, employee, work_date)
+        self._invalidate(*dates)
+        return [key for key in keys if key not in taken]
+
+    @staticmethod
+    def _existing_keys(
+        db: sqlite3.Connection, params: List[dict]
+    ) -> Set[Tuple[str, date, int]]:
+        "(employee, work_date, line_item) keys already stored on the cards of 'params'"
+        cards = json.dumps(
+            sorted({(row["employee"], str(row["work_date"])) for row in params})
+        )
+        sql = """
+        SELECT employee, work_date, line_item FROM records
+        WHERE (employee, work_date) IN (
+            SELECT value ->> 0, value ->> 1 FROM json_each(?))
+        """
+        return set(db.execute(sql, (cards,)))
 
     def _delete_record(self, work_date: date, item: int) -> None:
-        sql = "DELETE FROM records WHERE work_date=? AND line_item=?"
+        sql = "DELETE FROM records WHERE employee=? AND work_date=? AND line_item=?"
         with self._connect() as db:
-            db.execute(sql, (work_date, item))
+            db.execute(sql, (self._employee, work_date, item))
+        self._invalidate(work_date)
 
     def delete_record(self, work_date: date, item: int) -> None:
         """
         Remove record from database
         Line item numbers will be adjusted
         """
-        self._delete_record(work_date, item)
-        tc = self.get_timecard(work_date)
-        for e in tc:
-            self._delete_record(e["work_date"], e["line_item"])
-        for i, e in enumerate(tc):
-            e["line_item"] = i
-            self.add_record(e)
+        employee = self._employee
+        with self._connect() as db:
+            db.execute(
+                "DELETE FROM records WHERE employee=? AND work_date=? AND line_item=?",
+                (employee, work_date, item),
+            )
+            db.execute(
+                """
+                UPDATE records SET line_item = -line_item
+                WHERE employee=? AND work_date=? AND line_item > ?
+                """,
+                (employee, work_date, item),
+            )
+            self._settle(db, employee, work_date)
+        self._invalidate(work_date)
+
+    def move_record(self, work_date: date, item: int, new_item: int) -> int:
+        """
+        Move a record to position 'new_item' on its time card, shifting
+        the records in between by one. 'new_item' is clamped to the card.
+        Returns the record's new line item number.
+        """
+        employee = self._employee
+        with self._connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            (last,) = db.execute(
+                "SELECT MAX(line_item) FROM records WHERE employee=? AND work_date=?",
+                (employee, work_date),
+            ).fetchone()
+            if last is None or not 0 <= item <= last:
+                return item
+            new_item = max(0, min(new_item, last))
+            if new_item == item:
+                return item
+            db.execute(
+                """
+                UPDATE records SET line_item = -1 - CASE
+                    WHEN line_item = :item THEN :new_item
+                    WHEN :item < :new_item THEN line_item - 1
+                    ELSE line_item + 1 END
+                WHERE employee = :employee AND work_date = :work_date
+                AND line_item BETWEEN MIN(:item, :new_item) AND MAX(:item, :new_item)
+                """,
+                dict(employee=employee, work_date=work_date, item=item, new_item=new_item),
+            )
+            self._settle(db, employee, work_date)
+        self._invalidate(work_date)
+        return new_item
+
+    @staticmethod
+    def _settle(db: sqlite3.Connection, employee: str, work_date: date) -> None:
+        """
+        Renumbering parks rows at -1 - line_item so that no intermediate
+        state collides with the (employee, work_date, line_item) key;
+        flip them back.
+        """
+        db.execute(
+            """
+            UPDATE records SET line_item = -1 - line_item
+            WHERE employee=? AND work_date=? AND line_item < 0
+            """,
+            (employee, work_date),
+        )
 
     def get_timecard(self, work_date: date) -> TimeCard:
         """
         Reruns a TimeCard object for the given date and
         sets current_view
         """
-        sql = "SELECT * FROM records WHERE work_date=?"
+        rows = self._cached_rows(work_date)
+        tc = [TimeCardEntry(*record) for record in rows]
+        self.current_view = TimeCard(work_date, tc)
+        if self._prefetch and self._cache_size:
+            for days in PREFETCH_DAYS:
+                self._prefetch_queue.put(work_date + timedelta(days=days))
+            self._start_prefetch()
+        return self.current_view
+
+    def get_timecards(
+        self, start: date, end: date, employee: Optional[str] = None
+    ) -> Dict[date, TimeCard]:
+        """
+        Returns a TimeCard for every day from 'start' to 'end' inclusive,
+        read with a single range query. Days without records get an
+        empty TimeCard. 'employee' defaults to the current one, whose
+        cards are added to the cache.
+        """
+        if employee is None:
+            employee = self._employee
+        db = self._connect()
+        self._check_data_version(db)
+        with self._lock:
+            epoch = self._cache_epoch
+        days: Dict[date, List[tuple]] = {
+            start + timedelta(days=i): [] for i in range((end - start).days + 1)
+        }
+        sql = """
+        SELECT * FROM records WHERE employee=? AND work_date BETWEEN ? AND ?
+        ORDER BY work_date, line_item
+        """
+        for record in db.execute(sql, [employee, start, end]):
+            days[record[0]].append(record)
+        if employee == self._employee:
+            for work_date, rows in days.items():
+                self._cache_put(work_date, rows, epoch)
+        return {
+            work_date: TimeCard(work_date, [TimeCardEntry(*record) for record in rows])
+            for work_date, rows in days.items()
+        }
+
+    def employees(self) -> List[str]:
+        "Every employee with records, the owner ('') first"
+        sql = "SELECT DISTINCT employee FROM records ORDER BY employee"
+        return [employee for (employee,) in self._connect().execute(sql)]
+
+    def queue_submissions(
+        self,
+        work_dates: Iterable[date],
+        force: bool = False,
+        employee: Optional[str] = None,
+    ) -> int:
+        """
+        Add days of 'employee' (default the current one) to the outbox,
+        due now. A day that is already queued is queued once, forced if
+        either request was; earlier failed, skipped or unconfirmed entries
+        for the day are dropped. Returns the number of days queued.
+        """
+        if employee is None:
+            employee = self._employee
+        now = time.time()
+        days = [(employee, work_date) for work_date in sorted(set(work_dates))]
         with self._connect() as db:
-            c = db.execute(sql, [work_date])
-            tc = [TimeCardEntry(*record) for record in c.fetchall()]
-            c.close()
-            self.current_view = TimeCard(work_date, tc)
-            return self.current_view
+            db.execute("BEGIN IMMEDIATE")
+            db.executemany(
+                """
+                DELETE FROM outbox WHERE employee=? AND work_date=?
+                AND status IN ('failed', 'skipped', 'unconfirmed')
+                """,
+                days,
+            )
+            # an entry being sent keeps its lease, so it is not sent twice
+            db.executemany(
+                """
+                INSERT INTO outbox(employee, work_date, force, next_attempt)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (employee, work_date) WHERE status IN ('pending', 'sending')
+                DO UPDATE SET force = MAX(force, excluded.force),
+                attempts = CASE status WHEN 'pending' THEN 0 ELSE attempts END,
+                next_attempt = CASE status WHEN 'pending'
+                    THEN excluded.next_attempt ELSE next_attempt END
+                """,
+                [(*day, int(force), now) for day in days],
+            )
+        return len(days)
 
-    def find_records(
-        self, text: str, date1: date = date(2019, 1, 1), date2: date = date.today()
-    ) -> List[TimeCardEntry]:
+    def due_submissions(self, now: Optional[float] = None) -> List[OutboxEntry]:
+        "Unfinished outbox entries of every employee that are due, oldest first"
+        sql = f"""
+        SELECT {_OUTBOX_COLUMNS} FROM outbox
+        WHERE status IN ('pending', 'sending') AND next_attempt <= ?
+        ORDER BY next_attempt, id
+        """
+        rows = self._connect().execute(sql, (time.time() if now is None else now,))
+        return [_outbox_entry(row) for row in rows]
+
+    def claim_submissions(
+        self, entries: Iterable[OutboxEntry], lease: float
+    ) -> List[OutboxEntry]:
+        """
+        Mark outbox entries as being sent for the next 'lease' seconds and
+        count the attempt. Returns the claimed entries, leaving out any no
+        longer due because another sender claimed or finished them. If the
+        sender dies its entries are due again once the lease runs out.
+        """
+        now = time.time()
+        sql = f"""
+        UPDATE outbox SET status='sending', attempts=attempts + 1, next_attempt=?
+        WHERE id=? AND status IN ('pending', 'sending') AND next_attempt <= ?
+        RETURNING {_OUTBOX_COLUMNS}
+        """
+        claimed = []
+        with self._connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            for entry in entries:
+                row = db.execute(sql, (now + lease, entry.id, now)).fetchone()
+                if row:
+                    claimed.append(_outbox_entry(row))
+        return claimed
+
+    def finish_submission(
+        self,
+        entry_id: int,
+        status: str,
+        message: str = "",
+        next_attempt: Optional[float] = None,
+    ) -> None:
+        """
+        Record how sending an outbox entry went. An entry put back to
+        'pending' is due again at 'next_attempt'.
+        """
+        sql = """
+        UPDATE outbox SET status=?, message=?, next_attempt=COALESCE(?, next_attempt)
+        WHERE id=?
         """
-        Returns a list of TimeEntry objects who's description
-        matches 'text' and work_dates are betewwn 'date1' and 'date2'
+        with self._connect() as db:
+            db.execute(sql, (status, message, next_attempt, entry_id))
+
+    def next_submission(self) -> Optional[float]:
+        "When the next unfinished outbox entry is due, or None if there is none"
+        sql = """
+        SELECT MIN(next_attempt) FROM outbox WHERE status IN ('pending', 'sending')
+        """
+        return self._connect().execute(sql).fetchone()[0]
+
+    def expedite_submissions(self) -> int:
+        "Make every pending outbox entry due now. Returns how many there are"
+        sql = "UPDATE outbox SET next_attempt=? WHERE status='pending'"
+        with self._connect() as db:
+            return db.execute(sql, (time.time(),)).rowcount
+
+    def outbox(self) -> List[OutboxEntry]:
+        "Outbox entries of every employee that have not been submitted, by date"
+        sql = f"""
+        SELECT {_OUTBOX_COLUMNS} FROM outbox WHERE status != 'submitted'
+        ORDER BY employee, work_date
         """
+        return [_outbox_entry(row) for row in self._connect().execute(sql)]
+
+    def get_submissions(
+        self, start: date, end: date, employee: Optional[str] = None
+    ) -> Dict[date, Submission]:
+        "What was last submitted for each card of 'employee' from 'start' to 'end'"
+        if employee is None:
+            employee = self._employee
+        db = self._connect()
         sql = """
-        SELECT * FROM records WHERE description LIKE ?
-        AND (work_date BETWEEN ? AND ?)
+        SELECT work_date, url FROM submitted_cards
+        WHERE employee=? AND work_date BETWEEN ? AND ?
         """
-        text = f"%{text}%"
+        cards = {
+            work_date: Submission(url, {})
+            for work_date, url in db.execute(sql, (employee, start, end))
+        }
+        sql = """
+        SELECT work_date, aim_item, fingerprint FROM submitted_lines
+        WHERE employee=? AND work_date BETWEEN ? AND ? ORDER BY work_date, aim_item
+        """
+        for work_date, item, fingerprint in db.execute(sql, (employee, start, end)):
+            if work_date in cards:
+                cards[work_date].lines[item] = fingerprint
+        return cards
+
+    def save_submission(
+        self, work_date: date, submission: Submission, employee: Optional[str] = None
+    ) -> None:
+        "Record what was just submitted for a card, replacing the last submission"
+        if employee is None:
+            employee = self._employee
         with self._connect() as db:
-            c = db.execute(sql, [text, date1, date2])
-            r = [TimeCardEntry(*record) for record in c.fetchall()]
+            db.execute("BEGIN IMMEDIATE")
+            db.execute(
+                "INSERT OR REPLACE INTO submitted_cards VALUES (?, ?, ?)",
+                (employee, work_date, submission.url),
+            )
+            db.execute(
+                "DELETE FROM submitted_lines WHERE employee=? AND work_date=?",
+                (employee, work_date),
+            )
+            db.executemany(
+                "INSERT INTO submitted_lines VALUES (?, ?, ?, ?)",
+                [(employee, work_date, *line) for line in submission.lines.items()],
+            )
+
+    def hours_by_day(self, start: date, end: date) -> Dict[date, Dict[str, float]]:
+        "Hours per time_code for each day from 'start' to 'end'"
+        sql = """
+        SELECT work_date, time_code, hours FROM hours_daily
+        WHERE employee=? AND work_date BETWEEN ? AND ? ORDER BY work_date
+        """
+        return self._crosstab(sql, [self._employee, start, end])
+
+    def hours_by_week(self, start: date, end: date) -> Dict[date, Dict[str, float]]:
+        """
+        Hours per time_code for each week, keyed by its Monday, of the
+        weeks that start from 'start' to 'end'
+        """
+        sql = """
+        SELECT week, time_code, hours FROM hours_weekly
+        WHERE employee=? AND week BETWEEN ? AND ? ORDER BY week
+        """
+        return self._crosstab(sql, [self._employee, start, end])
+
+    def hours_by_workorder(
+        self, start: date, end: date
+    ) -> Dict[Tuple[str, str], Dict[str, float]]:
+        "Hours per time_code for each (workorder, phase) from 'start' to 'end'"
+        sql = """
+        SELECT workorder, phase, time_code, SUM(hours) FROM hours_workorder
+        WHERE employee=? AND work_date BETWEEN ? AND ?
+        GROUP BY workorder, phase, time_code ORDER BY workorder, phase
+        """
+        return self._crosstab(sql, [self._employee, start, end])
+
+    def _crosstab(self, sql: str, params: list) -> Dict[Any, Dict[str, float]]:
+        """
+        Collect (*key, time_code, hours) rows into {key: {time_code: hours}},
+        leaving out totals that have cancelled out to zero
+        """
+        table: Dict[Any, Dict[str, float]] = {}
+        for *key, time_code, hours in self._connect().execute(sql, params):
+            hours = round(hours, 2)
+            if hours:
+                key = key[0] if len(key) == 1 else tuple(key)
+                table.setdefault(key, {})[time_code] = hours
+        return table
+
+    def _check_data_version(self, db: sqlite3.Connection) -> None:
+        "Clear the cache if another connection wrote to the file"
+        (version,) = db.execute("PRAGMA data_version").fetchone()
+        if getattr(self._local, "data_version", version) != version:
+            self._invalidate()
+        self._local.data_version = version
+
+    def _cached_rows(self, work_date: date) -> List[tuple]:
+        db = self._connect()
+        self._check_data_version(db)
+        with self._lock:
+            rows = self._cache.get(work_date)
+            if rows is not None:
+                self._cache.move_to_end(work_date)
+                return rows
+            epoch = self._cache_epoch
+        sql = "SELECT * FROM records WHERE employee=? AND work_date=? ORDER BY line_item"
+        rows = db.execute(sql, [self._employee, work_date]).fetchall()
+        self._cache_put(work_date, rows, epoch)
+        return rows
+
+    def _cache_put(self, work_date: date, rows: List[tuple], epoch: int) -> None:
+        "Cache rows read at 'epoch', unless a write has happened since"
+        with self._lock:
+            if epoch != self._cache_epoch or not self._cache_size:
+                return
+            self._cache[work_date] = rows
+            self._cache.move_to_end(work_date)
+            while len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+
+    def _invalidate(self, *dates: date) -> None:
+        "Drop the given days from the cache, or all of them"
+        with self._lock:
+            self._cache_epoch += 1
+            if not dates:
+                self._cache.clear()
+            for work_date in dates:
+                self._cache.pop(work_date, None)
+
+    def _start_prefetch(self) -> None:
+        with self._lock:
+            if self._prefetch_thread:
+                return
+            self._prefetch_thread = threading.Thread(
+                target=self._run_prefetch, args=(self._prefetch_queue,), daemon=True
+            )
+            self._prefetch_thread.start()
+
+    def _run_prefetch(self, days: "queue.Queue[Optional[date]]") -> None:
+        while True:
+            work_date = days.get()
+            if work_date is None:
+                return
+            with self._lock:
+                if work_date in self._cache:
+                    continue
+            try:
+                self._cached_rows(work_date)
+            except sqlite3.Error:
+                pass
+
+    def find_records(
+        self,
+        text: str,
+        date1: date = date(2019, 1, 1),
+        date2: date = date.today(),
+        cancelled: Optional[Callable[[], bool]] = None,
+    ) -> List[TimeCardEntry]:
+        """
+        Returns a list of TimeEntry objects who's description, workorder
+        or action matches 'text' and work_dates are betewwn 'date1' and 'date2'.
+        With the full text index every word of 'text' is matched as a
+        prefix and the best matches come first; without it 'text' is
+        matched anywhere in the description.
+        If 'cancelled' returns True while the query runs, it is aborted
+        with sqlite3.OperationalError.
+        """
+        return list(self.iter_records(text, date1, date2, cancelled=cancelled))
+
+    def iter_records(
+        self,
+        text: str,
+        date1: date = date(2019, 1, 1),
+        date2: date = date.today(),
+        page_size: int = PAGE_SIZE,
+        cancelled: Optional[Callable[[], bool]] = None,
+    ) -> Iterator[TimeCardEntry]:
+        "Like find_records, but yields the matches as they are fetched"
+        for page in self.iter_pages(text, date1, date2, page_size, cancelled):
+            yield from page
+
+    def iter_pages(
+        self,
+        text: str,
+        date1: date = date(2019, 1, 1),
+        date2: date = date.today(),
+        page_size: int = PAGE_SIZE,
+        cancelled: Optional[Callable[[], bool]] = None,
+    ) -> Iterator[List[TimeCardEntry]]:
+        """
+        Yields the matches of find_records in lists of up to 'page_size'
+        entries, each fetched from a single cursor only when it is asked
+        for. The generator must be consumed on the thread that started it.
+        """
+        sql, params = self._search_sql(text, date1, date2)
+        db = self._connect()
+        with self._progress(db, cancelled):
+            c = db.execute(sql, params)
+        try:
+            while True:
+                with self._progress(db, cancelled):
+                    rows = c.fetchmany(page_size)
+                if not rows:
+                    return
+                yield [TimeCardEntry(*row) for row in rows]
+        finally:
             c.close()
-            return r
+
+    @staticmethod
+    @contextmanager
+    def _progress(
+        db: sqlite3.Connection, cancelled: Optional[Callable[[], bool]]
+    ) -> Iterator[None]:
+        if not cancelled:
+            yield
+            return
+        db.set_progress_handler(cancelled, PROGRESS_STEPS)
+        try:
+            yield
+        finally:
+            db.set_progress_handler(None, 0)
+
+    def matches(self, record: TimeCardEntry, text: str) -> bool:
+        """
+        Returns True if find_records would return 'record' for 'text',
+        ignoring the date range. Used to narrow earlier results in memory.
+        """
+        words = _WORD.findall(text.lower())
+        if self._fts and words:
+            tokens = _WORD.findall(
+                f"{record.description} {record.workorder} {record.action}".lower()
+            )
+            return all(any(t.startswith(w) for t in tokens) for w in words)
+        return text.lower() in record.description.lower()
+
+    def narrows(self, old: str, new: str) -> bool:
+        """
+        Returns True if find_records would return only records it returned
+        for 'old' when given 'new', so they can be narrowed with matches().
+        That is not so when one of them uses the full text index and the
+        other does not.
+        """
+        if not new.startswith(old):
+            return False
+        return not self._fts or bool(_WORD.findall(old)) == bool(_WORD.findall(new))
+
+    def _search_sql(self, text: str, date1: date, date2: date) -> Tuple[str, list]:
+        words = _WORD.findall(text)
+        if self._fts and words:
+            sql = """
+            SELECT records.* FROM records_fts
+            JOIN records ON records.rowid = records_fts.rowid
+            WHERE records_fts MATCH ? AND records.employee = ?
+            AND (records.work_date BETWEEN ? AND ?)
+            ORDER BY records_fts.rank
+            """
+            query = " ".join(f'"{word}"*' for word in words)
+            return sql, [query, self._employee, date1, date2]
+        if text:
+            sql = """
+            SELECT * FROM records WHERE description LIKE ?
+            AND employee = ? AND (work_date BETWEEN ? AND ?)
+            ORDER BY work_date, line_item
+            """
+            return sql, [f"%{text}%", self._employee, date1, date2]
+        sql = """
+        SELECT * FROM records WHERE employee = ? AND work_date BETWEEN ? AND ?
+        ORDER BY work_date, line_item
+        """
+        return sql, [self._employee, date1, date2]
 
     def _connect(self) -> sqlite3.Connection:
-        return sqlite3.connect(
+        """
+        Returns the calling thread's connection, opening it if needed.
+        Connections left behind by finished threads are closed here.
+        """
+        cached = getattr(self._local, "connection", None)
+        if cached and cached[0] == self._generation:
+            return cached[1]
+        conn = sqlite3.connect(
             self.dbfilename,
+            timeout=BUSY_TIMEOUT,
             detect_types=(sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES),
+            cached_statements=STATEMENT_CACHE_SIZE,
+            check_same_thread=False,
         )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA cache_size=-{PAGE_CACHE_KIB}")
+        thread = threading.current_thread()
+        with self._lock:
+            stale = [
+                key for key, (t, _) in self._connections.items() if not t.is_alive()
+            ]
+            for key in stale:
+                self._connections.pop(key)[1].close()
+            self._connections[thread.ident] = (thread, conn)
+            self._local.connection = (self._generation, conn)
+        return conn
 
 
 if __name__ == "__main__":
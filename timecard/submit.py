@@ -0,0 +1,527 @@
+"""
+Submitting time cards to AiM: several days through one logged in session,
+a crew's cards in parallel across browser worker processes, the days
+queued in the database's outbox from a background thread, or from asyncio.
+"""
+import asyncio
+import functools
+import hashlib
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date
+from multiprocessing import get_context
+from multiprocessing.util import Finalize
+from threading import Condition, Event, Thread
+from typing import (Callable, Dict, Iterator, List, NamedTuple, Optional,
+                    Tuple, Union)
+
+from .aim import (DATE_FORMAT, SAVED, SKIP, TIMEOUT, AimSession, EditFailed,
+                  Progress, SaveUnconfirmed, SessionPool, timecard_entries)
+from .config import CONFIG, CONFIG_FILE, employee_id
+from .database import OutboxEntry, Submission, TimeCard, TimeCardDatabase
+
+# Hours a submitted day is expected to add up to
+FULL_DAY = 8.0
+# Most browser worker processes a crew submit starts
+WORKERS = 4
+# Seconds before an outbox entry that could not be sent is retried,
+# doubling with every attempt up to MAX_RETRY_DELAY
+RETRY_DELAY = 30.0
+MAX_RETRY_DELAY = 60 * 60.0
+# Seconds outbox entries stay claimed by a sender, after which they are
+# due again in case it died
+LEASE = 10 * 60.0
+
+SUBMITTED = 'submitted'
+SKIPPED = 'skipped'
+FAILED = 'failed'
+# A day AiM may or may not have saved, to be checked there by hand
+# rather than sent again
+UNCONFIRMED = 'unconfirmed'
+# An outbox entry waiting to be (re)tried
+PENDING = 'pending'
+
+
+class DayResult(NamedTuple):
+    work_date: date
+    status: str
+    message: str
+    # what AiM now has for the day, when it was submitted
+    submission: Optional[Submission] = None
+    # workorders AiM rejected
+    invalid: Tuple[str, ...] = ()
+
+
+def skip_reason(card: TimeCard, force: bool = False) -> Optional[str]:
+    "Why a card should not be submitted, or None if it can be"
+    if not card:
+        return 'no entries'
+    if not force and abs(card.hours - FULL_DAY) > 1e-6:
+        return f'{card.hours:g} hours, not {FULL_DAY:g}'
+    return None
+
+
+def fingerprint(entry: Tuple[str, ...]) -> str:
+    "A short digest of a line as typed into AiM, where NULL is left blank"
+    text = '\x1f'.join(str(field or '') for field in entry)
+    return hashlib.sha1(text.encode()).hexdigest()[:16]
+
+
+def diff_lines(
+    lines: Dict[int, str], entries: List[Tuple[str, ...]]
+) -> Tuple[Dict[int, Tuple[str, ...]], List[Tuple[str, ...]], List[int]]:
+    """
+    Compare the fingerprints of the AiM lines last submitted, by item
+    number, with a card's entries. Entries that match a line are left
+    alone, the rest are typed over the unmatched lines in item order,
+    and any left over are added or their lines removed. Returns
+    ({item: entry} to change, entries to add, items to remove).
+    """
+    unmatched = defaultdict(list)
+    for item in sorted(lines):
+        unmatched[lines[item]].append(item)
+    fresh = []
+    for entry in entries:
+        items = unmatched[fingerprint(entry)]
+        if items:
+            items.pop(0)
+        else:
+            fresh.append(entry)
+    stale = sorted(item for items in unmatched.values() for item in items)
+    return (dict(zip(stale, fresh)), fresh[len(stale):], stale[len(fresh):])
+
+
+def unchanged(card: TimeCard, submission: Optional[Submission]) -> bool:
+    "Whether AiM already has exactly this card"
+    return bool(submission) and not any(
+        diff_lines(submission.lines, timecard_entries(card)))
+
+
+def submit_cards(
+    aim: AimSession,
+    employee: str,
+    cards: Dict[date, TimeCard],
+    force: bool = False,
+    progress: Optional[Callable[[date, Progress], None]] = None,
+    previous: Optional[Dict[date, Submission]] = None,
+    resubmit: bool = False,
+) -> List[DayResult]:
+    """
+    Submit each card in date order through 'aim', which must be logged in.
+    Days without entries, or that do not add up to FULL_DAY unless 'force'
+    is set, are skipped. Days in 'previous' only have their changed lines
+    sent, see submit_day for 'resubmit'. A day that fails or times out
+    does not stop the rest; one that timed out after it was saved is
+    UNCONFIRMED.
+    'progress' is called with each day's Progress.
+    """
+    previous = previous or {}
+    results = []
+    for work_date in sorted(cards):
+        card = cards[work_date]
+        reason = skip_reason(card, force)
+        if reason:
+            results.append(DayResult(work_date, SKIPPED, reason))
+            if progress:
+                progress(work_date, Progress(SKIP, error=reason))
+            continue
+        try:
+            result = submit_day(aim, employee, work_date, card, progress,
+                                previous.get(work_date), resubmit)
+        except _Cancelled:
+            # the days already done are kept, saved cards among them
+            if not results:
+                raise
+            break
+        except TimeoutError as e:
+            result = DayResult(work_date, FAILED, str(e))
+            if progress:
+                progress(work_date, Progress(TIMEOUT, error=str(e)))
+        except SaveUnconfirmed as e:
+            result = _unconfirmed(work_date, e)
+            if progress:
+                progress(work_date, Progress(TIMEOUT, error=result.message))
+        results.append(result)
+    return results
+
+
+def submit_day(
+    aim: AimSession,
+    employee: str,
+    work_date: date,
+    card: TimeCard,
+    progress: Optional[Callable[[date, Progress], None]] = None,
+    previous: Optional[Submission] = None,
+    resubmit: bool = False,
+) -> DayResult:
+    """
+    Submit one card through 'aim', failing it if AiM rejects a line.
+    A card submitted before is edited in place, touching only the lines
+    that changed since, and skipped if none did. If it cannot be edited
+    the day fails, unless 'resubmit' is set: then it is submitted as a
+    new card and the old one has to be deleted in AiM. A TimeoutError,
+    or SaveUnconfirmed once Save was clicked, is left to the caller.
+    """
+    entries = timecard_entries(card)
+    if previous:
+        changes, adds, removes = diff_lines(previous.lines, entries)
+        if not (changes or adds or removes):
+            return DayResult(work_date, SKIPPED, 'unchanged since last submit')
+        events = aim.edit_timecard(previous.url, changes, adds, removes,
+                                   max(previous.lines, default=0) + 1)
+        try:
+            event = _follow(events, work_date, progress)
+        except EditFailed as e:
+            if not resubmit:
+                # nothing was saved, so AiM still has the card as submitted
+                return DayResult(work_date, FAILED,
+                                 f'{e}; fix or delete the card in AiM, '
+                                 'or submit the day again as a new card',
+                                 previous)
+            previous = None
+    if not previous:
+        events = aim.new_timecard(employee, work_date.strftime(DATE_FORMAT),
+                                  entries)
+        event = _follow(events, work_date, progress)
+    # AiM keeps the card, less any rejected lines
+    url, items, rejected = aim.last_saved
+    if previous:
+        lines = {item: digest for item, digest in previous.lines.items()
+                 if item not in removes}
+        lines.update((item, fingerprint(entry)) for item, entry in changes.items()
+                     if item not in rejected)
+    else:
+        lines, adds = {}, entries
+    lines.update((item, fingerprint(entry)) for item, entry in zip(items, adds)
+                 if item is not None)
+    return DayResult(work_date, FAILED if event.failed else SUBMITTED, str(event),
+                     Submission(url, lines) if url else None, event.invalid)
+
+
+def _unconfirmed(work_date: date, error: SaveUnconfirmed) -> DayResult:
+    return DayResult(work_date, UNCONFIRMED,
+                     f'{error}; check the card in AiM before sending the day again')
+
+
+def _follow(events, work_date: date, progress) -> Progress:
+    "Pass each event on to 'progress'. Returns the last, the card being saved"
+    for event in events:
+        if progress:
+            progress(work_date, event)
+    return event
+
+
+class _Cancelled(Exception):
+    "Stops a submit running in an executor, between two steps"
+
+
+async def _in_executor(executor, progress, submit, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    cancelled = Event()
+
+    def report(work_date, event):
+        # a card AiM saved is returned all the same
+        if cancelled.is_set() and event.step != SAVED:
+            raise _Cancelled()
+        if progress:
+            loop.call_soon_threadsafe(progress, work_date, event)
+
+    future = loop.run_in_executor(
+        executor, functools.partial(submit, *args, progress=report, **kwargs))
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        cancelled.set()
+        # the session is only free again once the submit has stopped
+        await asyncio.wait([future])
+        if isinstance(future.exception(), _Cancelled):
+            raise
+        # it was too late to stop, and what AiM has must still be recorded
+        asyncio.current_task().uncancel()
+        return future.result()
+
+
+async def submit_day_async(
+    aim: AimSession,
+    employee: str,
+    work_date: date,
+    card: TimeCard,
+    progress: Optional[Callable[[date, Progress], None]] = None,
+    previous: Optional[Submission] = None,
+    resubmit: bool = False,
+    executor=None,
+) -> DayResult:
+    """
+    submit_day for asyncio. The webdriver runs in 'executor', the loop's
+    default one if None, and 'progress' is called on the event loop.
+    Cancelling stops the submit at its next step, leaving the card
+    unsaved, and only returns once the session is free again. Once the
+    card is being saved cancelling is too late, and the result is
+    returned as if it had not been cancelled.
+    """
+    return await _in_executor(executor, progress, submit_day, aim, employee,
+                              work_date, card, previous=previous,
+                              resubmit=resubmit)
+
+
+async def submit_cards_async(
+    aim: AimSession,
+    employee: str,
+    cards: Dict[date, TimeCard],
+    force: bool = False,
+    progress: Optional[Callable[[date, Progress], None]] = None,
+    previous: Optional[Dict[date, Submission]] = None,
+    resubmit: bool = False,
+    executor=None,
+) -> List[DayResult]:
+    """
+    submit_cards for asyncio, cancelled as submit_day_async is. If any
+    day was done before, the days so far are returned instead of raising
+    CancelledError. Cards sent through different sessions can be gathered.
+    """
+    return await _in_executor(executor, progress, submit_cards, aim, employee,
+                              cards, force, previous=previous,
+                              resubmit=resubmit)
+
+
+def retry_delay(attempts: int) -> float:
+    "Seconds to wait before the next try of an entry sent 'attempts' times"
+    return min(RETRY_DELAY * 2 ** min(max(attempts - 1, 0), 16), MAX_RETRY_DELAY)
+
+
+def summary(results: List[DayResult]) -> str:
+    "One line totals for a batch, e.g. '4 submitted, 1 failed, 2 skipped'"
+    counts = [(sum(r.status == status for r in results), status)
+              for status in (SUBMITTED, FAILED, UNCONFIRMED, SKIPPED, PENDING)]
+    return ', '.join(f'{n} {status}' for n, status in counts if n) or 'nothing to do'
+
+
+class OutboxWorker(Thread):
+    """
+    Sends the days queued in the outbox of 'db' through 'sessions' in the
+    background, as soon as they are due. A day that times out, or whose
+    browser fails, is retried with exponential backoff unless Save was
+    already clicked, which leaves it UNCONFIRMED; a day AiM rejects fails,
+    and one that is not ready is skipped. Days left in the outbox by an
+    earlier run are sent once the worker starts.
+
+    progress(entry, message, status) is called from the worker with the
+    Progress of a day being sent, with status None, then with its outcome
+    message; and with entry None and the totals after each batch.
+    """
+
+    def __init__(
+        self,
+        db: TimeCardDatabase,
+        sessions: SessionPool,
+        progress: Optional[Callable[[Optional[OutboxEntry], Union[Progress, str],
+                                     Optional[str]], None]] = None,
+    ) -> None:
+        super().__init__(daemon=True)
+        self.db = db
+        self.progress = progress
+        self._sessions = sessions
+        self._cond = Condition()
+        self._woken = False
+        self._stopped = False
+
+    def wake(self) -> None:
+        "Look at the outbox now, e.g. after queueing days"
+        with self._cond:
+            self._woken = True
+            self._cond.notify()
+
+    def stop(self) -> None:
+        """
+        Stop before the next step of the day being sent, which is left due
+        again unless AiM already saved it. Returns at once; the session
+        is only free again once that step is done.
+        """
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+
+    def run(self) -> None:
+        while True:
+            with self._cond:
+                if self._stopped:
+                    return
+                self._woken = False
+            try:
+                self.send_due()
+                due = self.db.next_submission()
+            except Exception as e:
+                self._progress(None, f'Outbox: {e}', FAILED)
+                due = time.time() + RETRY_DELAY
+            with self._cond:
+                if not self._woken and not self._stopped:
+                    self._cond.wait(None if due is None else max(due - time.time(), 0))
+
+    def send_due(self) -> List[DayResult]:
+        "Send every due day through one session. Returns their results"
+        due = iter(self.db.due_submissions())
+        # days are claimed one at a time, so a long batch cannot outlive
+        # the lease and be sent again by another sender
+        entry = self._claim_next(due)
+        if entry is None:
+            return []
+        CONFIG.read(CONFIG_FILE)
+        netid = CONFIG['AIM']['NETID']
+        debug = CONFIG['DEFAULT']['debug'] == 'True'
+        results = []
+        try:
+            with self._sessions.session(netid, debug) as aim:
+                while entry is not None:
+                    results.append(self._send(aim, entry))
+                    entry = None
+                    if not self._stopped:
+                        entry = self._claim_next(due)
+        except Exception as e:
+            # the browser would not start, log in or answer
+            error = str(e) or type(e).__name__
+            while entry is not None:
+                results.append(self._retry(entry, error))
+                entry = self._claim_next(due)
+        self._progress(None, summary(results), None)
+        return results
+
+    def _claim_next(self, due: Iterator[OutboxEntry]) -> Optional[OutboxEntry]:
+        "Claim the next of the 'due' days no other sender has taken"
+        for entry in due:
+            claimed = self.db.claim_submissions([entry], LEASE)
+            if claimed:
+                return claimed[0]
+        return None
+
+    def _send(self, aim: AimSession, entry: OutboxEntry) -> DayResult:
+        day = (entry.work_date, entry.work_date, entry.employee)
+        card = self.db.get_timecards(*day)[entry.work_date]
+        reason = skip_reason(card, entry.force)
+        if reason:
+            result = DayResult(entry.work_date, SKIPPED, reason)
+        else:
+            def report(_, event):
+                # a card AiM saved is still recorded
+                if self._stopped and event.step != SAVED:
+                    raise _Cancelled()
+                self._progress(entry, event, None)
+
+            try:
+                result = submit_day(
+                    aim, employee_id(entry.employee), entry.work_date, card,
+                    report, self.db.get_submissions(*day).get(entry.work_date))
+            except _Cancelled:
+                message = 'stopped before it was saved'
+                self.db.finish_submission(entry.id, PENDING, message, time.time())
+                return DayResult(entry.work_date, PENDING, message)
+            except TimeoutError as e:
+                return self._retry(entry, str(e))
+            except SaveUnconfirmed as e:
+                # AiM may have the card already, so it is not retried
+                result = _unconfirmed(entry.work_date, e)
+        if result.submission:
+            self.db.save_submission(entry.work_date, result.submission,
+                                    entry.employee)
+        self.db.finish_submission(entry.id, result.status, result.message)
+        self._progress(entry, result.message, result.status)
+        return result
+
+    def _retry(self, entry: OutboxEntry, error: str) -> DayResult:
+        delay = retry_delay(entry.attempts)
+        message = f'{error}, retrying in {delay / 60:.3g} min'
+        self.db.finish_submission(entry.id, PENDING, message, time.time() + delay)
+        self._progress(entry, message, PENDING)
+        return DayResult(entry.work_date, PENDING, message)
+
+    def _progress(self, entry: Optional[OutboxEntry],
+                  message: Union[Progress, str], status: Optional[str]) -> None:
+        if self.progress:
+            self.progress(entry, message, status)
+
+
+# The browser of a crew submit worker process, reused for all its cards
+_session: Optional[AimSession] = None
+_login = (None, False)
+
+
+def _start_worker(netid: str, debug: bool) -> None:
+    global _login
+    _login = (netid, debug)
+
+
+def _submit_employee(
+    employee: str,
+    cards: Dict[date, TimeCard],
+    force: bool,
+    previous: Dict[date, Submission],
+    resubmit: bool,
+) -> List[DayResult]:
+    "Runs in a worker process, which opens its browser on first use"
+    global _session
+    if _session is not None and not _session.healthy():
+        _session = None
+    if _session is None:
+        netid, debug = _login
+        _session = AimSession(netid=netid, debug=debug)
+        # worker processes skip atexit, but run multiprocessing finalizers
+        Finalize(_session, _session.driver.quit, exitpriority=10)
+    _session.ensure_login()
+    return submit_cards(_session, employee, cards, force, previous=previous,
+                        resubmit=resubmit)
+
+
+def submit_crew(
+    netid: str,
+    crew: Dict[str, Dict[date, TimeCard]],
+    force: bool = False,
+    workers: int = WORKERS,
+    debug: bool = False,
+    progress: Optional[Callable[[str, List[DayResult]], None]] = None,
+    previous: Optional[Dict[str, Dict[date, Submission]]] = None,
+    resubmit: bool = False,
+) -> Dict[str, List[DayResult]]:
+    """
+    Submit the cards of each employee in 'crew', keyed by AiM employee ID,
+    across up to 'workers' processes that each drive their own browser
+    logged in as 'netid'. Days in 'previous' only have their changed lines
+    sent. Employees with nothing to submit never reach a worker.
+    'progress' is called with each employee's results as soon as they are
+    done; an employee whose worker fails has every day failed.
+    """
+    previous = previous or {}
+    results: Dict[str, List[DayResult]] = {}
+    pending = {}
+    for employee, cards in crew.items():
+        sent = previous.get(employee, {})
+        if all(skip_reason(card, force) or unchanged(card, sent.get(work_date))
+               for work_date, card in cards.items()):
+            results[employee] = submit_cards(None, employee, cards, force,
+                                             previous=sent)
+            if progress:
+                progress(employee, results[employee])
+        else:
+            pending[employee] = cards
+    if not pending:
+        return results
+    # spawn rather than fork, so workers do not inherit the UI's terminal
+    # state, database connections or threads
+    with ProcessPoolExecutor(max_workers=min(workers, len(pending)),
+                             mp_context=get_context('spawn'),
+                             initializer=_start_worker,
+                             initargs=(netid, debug)) as pool:
+        futures = {
+            pool.submit(_submit_employee, employee, cards, force,
+                        previous.get(employee, {}), resubmit): employee
+            for employee, cards in pending.items()
+        }
+        for future in as_completed(futures):
+            employee = futures[future]
+            try:
+                results[employee] = future.result()
+            except Exception as e:
+                results[employee] = [DayResult(work_date, FAILED, str(e))
+                                     for work_date in sorted(pending[employee])]
+            if progress:
+                progress(employee, results[employee])
+    return results
@@ -0,0 +1,226 @@
+"""
+Streaming import and export of time card records as CSV and JSON lines,
+plus Parquet export when pyarrow is installed.
+"""
+import csv
+import json
+import os
+from collections import defaultdict
+from datetime import date, datetime
+from itertools import islice
+from typing import Dict, Iterable, Iterator, Optional, TextIO, Tuple
+
+from .database import TimeCardDatabase, TimeCardEntry
+
+# Records written per transaction
+BATCH_SIZE = 20000
+
+FORMATS = ("csv", "jsonl")
+EXPORT_FORMATS = ("csv", "jsonl", "parquet")
+FIELDS = TimeCardEntry.__slots__
+DATE_FORMATS = ("%Y-%m-%d", "%m/%d/%Y", "%d/%b/%Y", "%b %d, %Y")
+# Alternative column names found in spreadsheets and AiM exports
+ALIASES = {
+    "date": "work_date",
+    "item": "line_item",
+    "line": "line_item",
+    "wo": "workorder",
+    "work_order": "workorder",
+    "hrs": "hours",
+    "code": "time_code",
+    "labor_code": "time_code",
+    "leave_code": "time_code",
+    "employee_id": "employee",
+    "shop_person": "employee",
+}
+
+
+def _parse_date(value) -> date:
+    if isinstance(value, date):
+        return value
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(value.strip(), fmt).date()
+        except ValueError:
+            pass
+    raise ValueError(f"unrecognised date: {value!r}")
+
+
+def normalise(row: Dict[str, object]) -> Tuple[TimeCardEntry, bool]:
+    """
+    Build a TimeCardEntry from a row of text fields, padding workorder and
+    phase the way the entry form does. Rows without an employee column
+    are left for the database to assign. Returns the entry and whether
+    the row carried its own line item number.
+    """
+    fields = {}
+    for key, value in row.items():
+        if key is None:
+            continue
+        key = key.strip().lower().replace(" ", "_")
+        fields[ALIASES.get(key, key)] = value
+    has_item = fields.get("line_item") not in (None, "")
+    entry = TimeCardEntry(
+        work_date=_parse_date(fields["work_date"]),
+        line_item=int(fields["line_item"]) if has_item else 0,
+        workorder=str(fields.get("workorder") or "").strip().zfill(6),
+        phase=str(fields.get("phase") or "").strip().zfill(3),
+        hours=float(fields.get("hours") or 0),
+        description=str(fields.get("description") or "").strip(),
+        action=str(fields.get("action") or "").strip().upper(),
+        time_code=str(fields.get("time_code") or "R").strip().upper(),
+        employee=(
+            str(fields["employee"] or "").strip() if "employee" in fields else None
+        ),
+    )
+    return entry, has_item
+
+
+def read_records(rows: Iterable[Dict[str, object]]) -> Iterator[TimeCardEntry]:
+    """
+    Normalise rows one at a time. Rows without a line item are numbered
+    in file order within their card, so importing a file twice finds the
+    same (employee, work_date, line_item) keys.
+    """
+    counters: Dict[Tuple[Optional[str], date], int] = defaultdict(int)
+    for row in rows:
+        entry, has_item = normalise(row)
+        card = (entry.employee, entry.work_date)
+        if not has_item:
+            entry.line_item = counters[card]
+        counters[card] = max(counters[card], entry.line_item + 1)
+        yield entry
+
+
+def read_csv(f: TextIO) -> Iterator[TimeCardEntry]:
+    return read_records(csv.DictReader(f))
+
+
+def read_jsonl(f: TextIO) -> Iterator[TimeCardEntry]:
+    return read_records(json.loads(line) for line in f if line.strip())
+
+
+def import_records(
+    db: TimeCardDatabase, records: Iterable[TimeCardEntry], batch_size: int = BATCH_SIZE
+) -> Tuple[int, int]:
+    """
+    Add records in batched transactions, skipping any whose
+    (employee, work_date, line_item) is already taken.
+    Returns the number of records added and skipped.
+    """
+    added = skipped = 0
+    records = iter(records)
+    while True:
+        batch = list(islice(records, batch_size))
+        if not batch:
+            return added, skipped
+        duplicates = len(db.add_records(batch, on_conflict="ignore"))
+        added += len(batch) - duplicates
+        skipped += duplicates
+
+
+def _format(filename: str, fmt: Optional[str]) -> str:
+    "The given format, or the one matching the file extension"
+    if fmt:
+        return fmt
+    ext = os.path.splitext(filename)[1].lower()
+    if ext in (".jsonl", ".json", ".ndjson"):
+        return "jsonl"
+    if ext in (".parquet", ".pq"):
+        return "parquet"
+    return "csv"
+
+
+def import_file(
+    db: TimeCardDatabase, filename: str, fmt: Optional[str] = None
+) -> Tuple[int, int]:
+    """
+    Import a CSV or JSON lines file; the format is taken from the file
+    extension unless given. Returns the number of records added and skipped.
+    """
+    fmt = _format(filename, fmt)
+    if fmt not in FORMATS:
+        raise ValueError(f"unknown import format: {fmt!r}")
+    with open(filename, newline="", encoding="utf-8-sig") as f:
+        records = read_csv(f) if fmt == "csv" else read_jsonl(f)
+        return import_records(db, records)
+
+
+def write_csv(records: Iterable[TimeCardEntry], f: TextIO) -> int:
+    writer = csv.writer(f)
+    writer.writerow(FIELDS)
+    count = 0
+    for count, record in enumerate(records, 1):
+        writer.writerow([record[name] for name in FIELDS])
+    return count
+
+
+def write_jsonl(records: Iterable[TimeCardEntry], f: TextIO) -> int:
+    count = 0
+    for count, record in enumerate(records, 1):
+        row = record.dict()
+        row["work_date"] = record.work_date.isoformat()
+        f.write(json.dumps(row) + "\n")
+    return count
+
+
+def write_parquet(
+    records: Iterable[TimeCardEntry], filename: str, batch_size: int = BATCH_SIZE
+) -> int:
+    """
+    Write records as Parquet, one row group per batch, so only one batch
+    is held in memory. Needs pyarrow.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ValueError("Parquet export needs pyarrow installed") from None
+    schema = pa.schema(
+        [
+            ("work_date", pa.date32()),
+            ("line_item", pa.int32()),
+            ("workorder", pa.string()),
+            ("phase", pa.string()),
+            ("hours", pa.float64()),
+            ("description", pa.string()),
+            ("action", pa.string()),
+            ("time_code", pa.string()),
+            ("employee", pa.string()),
+        ]
+    )
+    count = 0
+    records = iter(records)
+    with pq.ParquetWriter(filename, schema) as writer:
+        while True:
+            batch = list(islice(records, batch_size))
+            if not batch:
+                return count
+            columns = {name: [r[name] for r in batch] for name in FIELDS}
+            writer.write_table(pa.table(columns, schema=schema))
+            count += len(batch)
+
+
+def export_records(
+    db: TimeCardDatabase,
+    filename: str,
+    text: str = "",
+    date1: date = date(2019, 1, 1),
+    date2: Optional[date] = None,
+    fmt: Optional[str] = None,
+) -> int:
+    """
+    Write the records find_records would return to a file, streaming
+    them from the database cursor. The format is taken from the file
+    extension unless given. Returns the number of records written.
+    """
+    fmt = _format(filename, fmt)
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"unknown export format: {fmt!r}")
+    records = db.iter_records(text, date1, date2 or date.today())
+    if fmt == "parquet":
+        return write_parquet(records, filename)
+    with open(filename, "w", newline="", encoding="utf-8") as f:
+        if fmt == "csv":
+            return write_csv(records, f)
+        return write_jsonl(records, f)
@@ -1,13 +1,12 @@
 #!/usr/bin/env python3
 import datetime
 import os
+import sqlite3
 import sys
 from collections import defaultdict
-from configparser import ConfigParser
 from typing import Callable, NoReturn
-from threading import Thread
+from threading import Condition, Lock, Thread
 
-import keyring
 from asciimatics.event import KeyboardEvent
 from asciimatics.exceptions import (NextScene, ResizeScreenError,
                                     StopApplication)
@@ -20,8 +19,12 @@ from asciimatics.widgets import (Button, CheckBox, DatePicker, Divider,
                                  )
 from asciimatics.widgets.utilities import THEMES
 
-from .aim import AimSession
-from .database import TimeCardDatabase
+from .aim import Progress, SessionPool
+from .config import CONFIG, CONFIG_FILE, crew, employee_id, load
+from .database import PAGE_SIZE, TimeCardDatabase, TimeCardEntry
+from .submit import (FAILED, PENDING, UNCONFIRMED, OutboxWorker, skip_reason,
+                     submit_crew, summary)
+from .transfer import EXPORT_FORMATS, export_records, import_file
 from .__init__ import version
 
 
@@ -54,8 +57,10 @@ def __refresh(self):
 Screen.refresh = __refresh
 # End Monkey patch
 PASTE_BUFFER = {}
-CONFIG = ConfigParser()
-CONFIG_FILE = os.path.join(os.path.expanduser('~'), '.timetrack')
+# Browser kept logged in to AiM between submits
+AIM_SESSIONS = SessionPool()
+# Sends queued days in the background; started with the first screen
+OUTBOX = None
 # Build custom theme with transparency support
 MY_THEME = defaultdict(lambda: (None, 1, None))
 MY_THEME['invalid'] = (None, 1, 1)
@@ -79,6 +84,10 @@ ACTIONS = {'WORK COMPLETE': 1,
            'OVERHEAD': 4}
 TIME_CODES = {'R': 1, 'CP': 2, 'OT': 3, 'A': 4, 'S': 5,
               'PH': 6, 'CT': 7, 'ASG': 8, 'HOLIDAY': 9, 'HOMEWORK': 10}
+PERIODS = {'Week': 7, 'Pay period': 14}
+REPORTS = {'By day': 1, 'By week': 2, 'By workorder': 3}
+# First day of a known pay period; periods repeat every 14 days from here
+PAY_PERIOD_START = datetime.date(2019, 1, 7)
 # DEFAULT_ENTRIES = [dict(workorder='000051',
 #                         phase='039',
 #                         hours=0.5,
@@ -102,6 +111,11 @@ DEFAULT_ENTRIES = [dict(workorder='000032',
 
 
 class StatusLine(Text):
+    """
+    A read only line of messages. It is drawn with the rest of its frame,
+    so workers post() changes to the frame instead of setting it.
+    """
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.disabled = True
@@ -116,23 +130,12 @@ class StatusLine(Text):
             text, self.width, self._frame.canvas.unicode_aware)
         text += " " * (self.width - self.string_len(text))
 
-        self._frame.screen.print_at(
+        self._frame.canvas.print_at(
             text,
             self._x + self._offset,
             self._y,
             colour, attr, bg)
 
-    @property
-    def value(self):
-        return self._value
-
-    @value.setter
-    def value(self, new_value):
-        self._set_and_check_value(new_value, reset=True)
-        if self._frame:
-            self.update(self._frame)
-            self._frame.screen.refresh()
-
 
 class EntryList(MultiColumnListBox):
     def process_event(self, event):
@@ -144,9 +147,38 @@ class EntryList(MultiColumnListBox):
             elif event.key_code in (ord('+'), ord('a'), ord('A')):
                 self._frame.on_add()
                 event = None
+            elif event.key_code == ord('['):
+                self._frame.on_move(-1)
+                event = None
+            elif event.key_code == ord(']'):
+                self._frame.on_move(1)
+                event = None
         return super().process_event(event)
 
 
+class LazyListBox(MultiColumnListBox):
+    """
+    A MultiColumnListBox holding only the rows loaded so far. While more
+    rows are available, moving the selection within a screen of the last
+    loaded row calls on_more to fetch the next page.
+    """
+
+    def __init__(self, *args, on_more=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._on_more = on_more
+        self.complete = True
+
+    def extend(self, options):
+        self._options.extend(self._parse_options(options))
+
+    def process_event(self, event):
+        event = super().process_event(event)
+        if (not self.complete and self._on_more and
+                self._line >= len(self._options) - self._h):
+            self._on_more()
+        return event
+
+
 class BoxedButton(Button):
     def __init__(self, text, on_click, min_width=10):
         super().__init__(text, on_click, add_box=False)
@@ -203,7 +235,36 @@ class BoxedButton(Button):
             super().update(frame_no)
 
 
-class TimeCardView(Frame):
+class UpdateQueue:
+    """
+    Mixin for frames that worker threads update. Widgets are only touched
+    on the UI thread: workers post() calls, which the frame makes all at
+    once on its next tick, before drawing itself once.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._posted_lock = Lock()
+        self._posted = []
+        super().__init__(*args, **kwargs)
+
+    def post(self, func: Callable, *args) -> None:
+        "Call func(*args) on the UI thread before the next frame; thread safe"
+        with self._posted_lock:
+            self._posted.append((func, args))
+            wake = len(self._posted) == 1
+        if wake:
+            # one wake up for everything posted before the next tick
+            self.screen.force_update()
+
+    def _update(self, frame_no):
+        with self._posted_lock:
+            posted, self._posted = self._posted, []
+        for func, args in posted:
+            func(*args)
+        super()._update(frame_no)
+
+
+class TimeCardView(UpdateQueue, Frame):
     def __init__(self, screen: Screen, db: TimeCardDatabase) -> None:
         super().__init__(screen, screen.height, screen.width,
                          title="Time Card",
@@ -228,11 +289,14 @@ class TimeCardView(Frame):
         self._status_line = StatusLine()
 
         self.data['work_date'] = datetime.date.today()
+        self.data['employee'] = db.employee
+        self._employee = DropdownList(self._employees(), 'Employee: ',
+                                      'employee', on_change=self._reload_list)
 
-        head = Layout([100])
+        head = Layout([1, 1])
         main = Layout([100], fill_frame=True)
         foot = Layout([100])
-        buttons = Layout([1, 1, 1, 1, 1, 1])
+        buttons = Layout([1, 1, 1, 1, 1, 1, 1])
         status = Layout([100])
 
         self.add_layout(head)
@@ -244,6 +308,8 @@ class TimeCardView(Frame):
         head.add_widget(Divider(draw_line=False))
         head.add_widget(DatePicker(
             'Work Date: ', name='work_date', on_change=self._reload_list))
+        head.add_widget(Divider(draw_line=False), 1)
+        head.add_widget(self._employee, 1)
         self.data['work_date'] = datetime.date.today()
 
         main.add_widget(Divider())
@@ -255,18 +321,34 @@ class TimeCardView(Frame):
         buttons.add_widget(BoxedButton('+Overhead', self.on_add_overhead), 0)
         buttons.add_widget(BoxedButton('Submit', self.on_submit), 1)
         # buttons.add_widget(BoxedButton('Vacation', self.on_vacation), 2)
+        buttons.add_widget(BoxedButton('Week', self.on_period), 2)
         buttons.add_widget(BoxedButton('Settings', self.on_settings), 3)
         buttons.add_widget(BoxedButton('Search', self.on_search), 4)
-        buttons.add_widget(BoxedButton('Quit', self.on_quit), 5)
+        buttons.add_widget(BoxedButton('Reports', self.on_reports), 5)
+        buttons.add_widget(BoxedButton('Quit', self.on_quit), 6)
 
         status.add_widget(self._status_line)
 
         self.fix()
 
+    def _employees(self):
+        "Dropdown options for the owner and each crew member"
+        employees = [('Me', '')] + [(e, e) for e in crew()]
+        if self._db.employee not in (e for _, e in employees):
+            employees.append((self._db.employee, self._db.employee))
+        return employees
+
     # new_value param is required by asciimatics API
     def _reload_list(self, new_value=None):
         self.set_theme(CONFIG['DEFAULT']['theme'])
         self.save()
+        employees = self._employees()
+        if self._employee.options != employees:
+            self._employee.options = employees
+            self._employee.value = self._db.employee
+            self.save()
+        # every screen shows the cards of the employee picked here
+        self._db.employee = self.data['employee']
         self._cache = self._db.get_timecard(self.data['work_date'])
         options = [(entry.values()[2:], i)
                    for i, entry in enumerate(self._cache)]
@@ -298,18 +380,19 @@ class TimeCardView(Frame):
             r = PASTE_BUFFER
             r['work_date'] = self.data['work_date']
             r['line_item'] = len(self._cache)
-            self._db.add_record(r)
+            r['employee'] = self._db.employee
+            self._db.add_record(r, on_conflict='append')
             self._reload_list()
 
     def on_add_overhead(self):
         "Add the default entries"
         count = len(self._cache)
-        for i, template in enumerate(DEFAULT_ENTRIES):
-            entry = defaultdict(lambda: '',
-                                work_date=self.data['work_date'],
-                                line_item=(count + i),
-                                **template)
-            self._db.add_record(entry)
+        self._db.add_records(
+            (TimeCardEntry(work_date=self.data['work_date'],
+                           line_item=(count + i),
+                           **template)
+             for i, template in enumerate(DEFAULT_ENTRIES)),
+            on_conflict='append')
         self._db.get_timecard(self.data['work_date'])
         self._reload_list()
 
@@ -329,37 +412,53 @@ class TimeCardView(Frame):
             self.data['work_date'], self.data['time_entries'])
         self._reload_list()
 
+    def on_move(self, offset):
+        "move selected entry up or down the time card"
+        self.save()
+        item = self.data['time_entries']
+        if item is None or item >= len(self._cache):
+            return
+        item = self._db.move_record(
+            self.data['work_date'], item, item + offset)
+        self._reload_list()
+        self._entries.value = item
+
     def on_search(self):
         self.save()
         raise NextScene('Search')
 
+    def on_period(self):
+        self.save()
+        raise NextScene('Period')
+
+    def on_reports(self):
+        self.save()
+        raise NextScene('Reports')
+
     def on_settings(self):
         self.scene.add_effect(SettingsView(self.screen, self._db))
 
-    def _on_submit(self):
-        "Submit time card in AiM"
-        entries = [entry.values()[2:] for entry in self._cache]
-        # we want to submit the overhead entries last
-        entries.sort(key=lambda e: e[0], reverse=True)
-        workdate = self._cache.date.strftime('%b %d, %Y')
-        CONFIG.read(CONFIG_FILE)
-        self._status_line.value = 'Creating webdriver...'
-        d = CONFIG['DEFAULT']['debug'] == 'True'
-        with AimSession(netid=CONFIG['AIM']['NETID'], debug=d) as aim:
-            self._status_line.value = 'logging in...'
-            try:
-                aim.login()
-            except TimeoutError:
-                self._status_line.custom_colour = 'invalid'
-                self._status_line.value = "login timed out"
-                return
-            for msg in aim.new_timecard(CONFIG['AIM']['EMPLOYEE_ID'], workdate, entries):
-                if 'error' in msg.lower():
-                    self._status_line.custom_colour = 'invalid'
-                self._status_line.value = msg
-
     def on_submit(self):
-        Thread(target=self._on_submit).start()
+        "Queue the time card for AiM; the outbox sends it in the background"
+        self.save()
+        self._db.queue_submissions([self.data['work_date']], force=True)
+        OUTBOX.wake()
+        self._status_line.custom_colour = 'edit_text'
+        self._status_line.value = 'Queued for AiM...'
+
+    def post_outbox(self, entry, message, status):
+        "Called from the outbox worker; shown on the next frame"
+        if entry is not None:
+            self.post(self._show_outbox, entry, message, status)
+
+    def _show_outbox(self, entry, message, status):
+        # only the progress of the card on screen is shown
+        if (entry.employee, entry.work_date) == (
+                self._db.employee, self.data['work_date']):
+            if status in (FAILED, PENDING, UNCONFIRMED) or (
+                    isinstance(message, Progress) and message.failed):
+                self._status_line.custom_colour = 'invalid'
+            self._status_line.value = str(message)
 
     def process_event(self, event):
         if isinstance(event, KeyboardEvent):
@@ -445,7 +544,7 @@ class TimeEntryEdit(Frame):
         self.data['phase'] = self.data['phase'].zfill(3)
 
         if not self._db.active_record:
-            self._db.add_record(self.data)
+            self._db.add_record(self.data, on_conflict='append')
         else:
             self._db.update_record(self.data)
         self.data = {}
@@ -537,7 +636,181 @@ class FileBrowsePopup(Frame):
         scene.add_effect(FileBrowsePopup(screen, self._target))
 
 
-class SearchView(Frame):
+class ExportPopup(Frame):
+    "Ask where to write the records matching a search"
+
+    def __init__(self, screen, db, search):
+        super().__init__(screen, 9, int(screen.width * 2 // 3),
+                         title='Export',
+                         can_scroll=False,
+                         has_shadow=True,
+                         reduce_cpu=True)
+        self._db = db
+        self._search = search
+        self.set_theme(CONFIG['DEFAULT']['theme'])
+        form = Layout([100], fill_frame=True)
+        buttons = Layout([1, 2, 1])
+
+        self.add_layout(form)
+        self.add_layout(buttons)
+
+        self.data['export_file'] = os.path.join(
+            os.path.expanduser('~'), 'timecard.csv')
+        self.data['export_format'] = EXPORT_FORMATS[0]
+        form.add_widget(Text('File:', 'export_file'))
+        form.add_widget(DropdownList([(f, f) for f in EXPORT_FORMATS],
+                                     'Format:', 'export_format',
+                                     on_change=self._on_format))
+        buttons.add_widget(BoxedButton('Cancel', self.on_cancel), 0)
+        buttons.add_widget(BoxedButton('Export', self.on_export), 2)
+
+        self.fix()
+
+    def _on_format(self):
+        "Keep the file extension in step with the format"
+        self.save()
+        root = os.path.splitext(self.data['export_file'])[0]
+        ext = '.' + self.data['export_format']
+        self.find_widget('export_file').value = root + ext
+
+    def on_export(self):
+        self.save()
+        text, date1, date2 = self._search
+        try:
+            count = export_records(self._db, self.data['export_file'],
+                                   text, date1, date2,
+                                   self.data['export_format'])
+            message = f'{count} records exported'
+        except (OSError, ValueError) as e:
+            message = f'Export failed: {e}'
+        scene = self.scene
+        scene.remove_effect(self)
+        scene.add_effect(PopUpDialog(self.screen, message, ['OK']))
+
+    def on_cancel(self):
+        self.scene.remove_effect(self)
+
+    def process_event(self, event):
+        if isinstance(event, KeyboardEvent) and event.key_code == Screen.KEY_ESCAPE:
+            self.on_cancel()
+            event = None
+        super().process_event(event)
+
+    def clone(self, screen, scene):
+        self.scene.remove_effect(self)
+
+
+class SearchWorker(Thread):
+    """
+    Runs searches off the UI thread. Requests are debounced, a running
+    query is aborted as soon as a newer request arrives, and a filter that
+    only extends the previous one is answered by narrowing the previous
+    results in memory instead of querying again.
+
+    Results are streamed a page at a time: on_result(page, reset, complete)
+    is called with the first page of a new search (reset=True) and with
+    each further page asked for through more(). A query that fails is
+    reported as on_result([], True, True, error), and the worker carries on.
+    """
+
+    def __init__(self, db, on_result, delay=0.15):
+        super().__init__(daemon=True)
+        self._db = db
+        self._on_result = on_result
+        self._delay = delay
+        self._cond = Condition()
+        self._request = None
+        self._want_more = False
+        self._serial = 0
+        self._last = None
+        self._pages = None
+        self._stopped = False
+
+    def stop(self):
+        "Abort any running query and end the thread"
+        with self._cond:
+            self._stopped = True
+            self._serial += 1
+            self._cond.notify()
+
+    def search(self, text, date1, date2):
+        with self._cond:
+            # searches are of the current employee's records
+            self._request = (text, date1, date2, self._db.employee)
+            self._serial += 1
+            self._cond.notify()
+
+    def more(self):
+        with self._cond:
+            self._want_more = True
+            self._cond.notify()
+
+    def _stale(self, serial):
+        return self._serial != serial
+
+    def run(self):
+        while True:
+            with self._cond:
+                while (self._request is None and not self._want_more
+                       and not self._stopped):
+                    self._cond.wait()
+                if self._stopped:
+                    return
+                self._want_more = False
+                serial = self._serial
+                if self._request is not None:
+                    # wait until the user pauses typing
+                    while self._cond.wait_for(lambda: self._stale(serial),
+                                              self._delay):
+                        serial = self._serial
+                    if self._stopped:
+                        return
+                request, self._request = self._request, None
+            try:
+                if request is not None:
+                    self._start(request, serial)
+                elif self._pages is not None:
+                    self._next_page(serial, reset=False)
+            except sqlite3.Error as e:
+                # an aborted query fails too, but is no longer wanted
+                self._pages = None
+                self._last = None
+                if not self._stale(serial):
+                    self._on_result([], True, True, str(e))
+
+    def _start(self, request, serial):
+        text, *scope = request
+        date1, date2, _ = scope
+        if self._pages is not None:
+            self._pages.close()
+            self._pages = None
+        if self._last and self._last[2]:
+            (last_text, *last_scope), records, _ = self._last
+            if last_scope == scope and self._db.narrows(last_text, text):
+                records = [r for r in records if self._db.matches(r, text)]
+                self._last = (request, records, True)
+                self._on_result(records, True, True)
+                return
+        self._last = (request, [], False)
+        self._pages = self._db.iter_pages(
+            text, date1, date2, cancelled=lambda: self._stale(serial))
+        self._next_page(serial, reset=True)
+
+    def _next_page(self, serial, reset):
+        page = next(self._pages, None) or []
+        # a short page means the cursor is exhausted
+        complete = len(page) < PAGE_SIZE
+        if complete:
+            self._pages.close()
+            self._pages = None
+        request, records, _ = self._last
+        records.extend(page)
+        self._last = (request, records, complete)
+        if not self._stale(serial):
+            self._on_result(page, reset, complete)
+
+
+class SearchView(UpdateQueue, Frame):
     def __init__(self, screen, db):
         super().__init__(screen, screen.height, screen.width,
                          title="Search",
@@ -546,13 +819,16 @@ class SearchView(Frame):
                          on_load=self._reload_list)
         self._db = db
         self._records_cache = []
+        self._search = SearchWorker(db, self._post_result)
+        self._search.start()
         self.set_theme(CONFIG['DEFAULT']['theme'])
-        self._results = MultiColumnListBox(Widget.FILL_FRAME,
-                                           ['>5', 10, '>10', '>6', 0],
-                                           [],
-                                           ['', 'WORK DATE', 'WORKORDER',
-                                               'PHASE', 'DESCRIPTION'],
-                                           name='result')
+        self._results = LazyListBox(Widget.FILL_FRAME,
+                                    ['>5', 10, '>10', '>6', 0],
+                                    [],
+                                    ['', 'WORK DATE', 'WORKORDER',
+                                        'PHASE', 'DESCRIPTION'],
+                                    name='result',
+                                    on_more=self._search.more)
 
         self._filter = Text('Filter:', 'filter', self._reload_list)
         self._total = Text('Total')
@@ -563,7 +839,7 @@ class SearchView(Frame):
         search = Layout([100])
         results = Layout([100], fill_frame=True)
         total = Layout([100])
-        buttons = Layout([100])
+        buttons = Layout([1, 1])
 
         self.data['date1'] = datetime.date(2019, 1, 1)
         self.data['date2'] = datetime.date.today()
@@ -585,28 +861,57 @@ class SearchView(Frame):
         results.add_widget(self._results)
         total.add_widget(self._total)
         total.add_widget(Divider())
-        buttons.add_widget(BoxedButton('Done', self.on_done))
+        buttons.add_widget(BoxedButton('Export', self.on_export), 0)
+        buttons.add_widget(BoxedButton('Done', self.on_done), 1)
 
         self.fix()
 
     def _reload_list(self):
         self.save()
-        records = self._db.find_records(
+        self._search.search(
             self.data['filter'], self.data['date1'], self.data['date2'])
+
+    def _post_result(self, page, reset, complete, error=None):
+        "Called from the search worker; results are shown on the next frame"
+        self.post(self._show_results, page, reset, complete, error)
+
+    def stop(self):
+        "Stop the search worker, once the view is no longer used"
+        self._search.stop()
+
+    def _show_results(self, page, reset, complete, error=None):
+        if reset:
+            self._records_cache = []
+        start = len(self._records_cache)
         options = []
-        for i, entry in enumerate(records):
-            e = [str(i + 1), str(entry['work_date']),
+        for i, entry in enumerate(page, start + 1):
+            e = [str(i), str(entry['work_date']),
                  entry['workorder'], entry['phase'], entry['description']]
-            options.append((e, i + 1))
-        self._results.options = options
-        self._total.value = str(len(options))
-        self._records_cache = records
+            options.append((e, i))
+        if reset:
+            self._results.options = options
+        else:
+            self._results.extend(options)
+        self._results.complete = complete
+        self._records_cache.extend(page)
+        total = len(self._records_cache)
+        if error:
+            self._total.value = f'Search failed: {error}'
+        else:
+            self._total.value = str(total) if complete else f'{total}+'
+        self._total.custom_colour = 'invalid' if error else 'edit_text'
 
     def on_copy(self):
         global PASTE_BUFFER
         self.save()
         PASTE_BUFFER = self._records_cache[self.data['result'] - 1]
 
+    def on_export(self):
+        "Export everything the current filter matches, not just the loaded pages"
+        self.save()
+        search = (self.data['filter'], self.data['date1'], self.data['date2'])
+        self.scene.add_effect(ExportPopup(self.screen, self._db, search))
+
     def on_done(self):
         raise NextScene('Main')
 
@@ -617,6 +922,285 @@ class SearchView(Frame):
         super().process_event(event)
 
 
+class PeriodView(UpdateQueue, Frame):
+    """
+    Daily totals for the week or pay period around a date, from where the
+    whole period can be submitted through one AiM session
+    """
+
+    def __init__(self, screen, db):
+        super().__init__(screen, screen.height, screen.width,
+                         title="Period",
+                         can_scroll=False,
+                         reduce_cpu=True,
+                         on_load=self._reload_list)
+        self.set_theme(CONFIG['DEFAULT']['theme'])
+        self._db = db
+        self._days = [Text() for _ in range(max(PERIODS.values()))]
+        for day in self._days:
+            day.disabled = True
+        self._labels = {}
+        self._total = Text('Total: ')
+        self._total.disabled = True
+        self._status = Text()
+        self._status.disabled = True
+        self._submitting = False
+
+        self.data['work_date'] = datetime.date.today()
+        self.data['period'] = PERIODS['Week']
+        self.data['force'] = False
+        self.data['crew'] = False
+
+        head = Layout([1, 1, 1, 1])
+        main = Layout([100], fill_frame=True)
+        foot = Layout([100])
+        buttons = Layout([1, 1])
+
+        self.add_layout(head)
+        self.add_layout(main)
+        self.add_layout(foot)
+        self.add_layout(buttons)
+
+        head.add_widget(DatePicker('Date: ', name='work_date',
+                                   on_change=self._reload_list), 0)
+        head.add_widget(DropdownList(list(PERIODS.items()), 'Period: ',
+                                     'period', on_change=self._reload_list), 1)
+        head.add_widget(CheckBox('Submit days not totalling 8 hours',
+                                 'Force: ', 'force'), 2)
+        head.add_widget(CheckBox('Submit for me and the whole crew',
+                                 'Crew: ', 'crew'), 3)
+        main.add_widget(Divider())
+        for day in self._days:
+            main.add_widget(day)
+        foot.add_widget(Divider())
+        foot.add_widget(self._total)
+        foot.add_widget(self._status)
+        foot.add_widget(Divider())
+        buttons.add_widget(BoxedButton('Submit', self.on_submit), 0)
+        buttons.add_widget(BoxedButton('Done', self.on_done), 1)
+
+        self.fix()
+
+    def _period(self):
+        "First and last day of the selected period"
+        work_date = self.data['work_date']
+        if self.data['period'] == PERIODS['Week']:
+            start = work_date - datetime.timedelta(days=work_date.weekday())
+        else:
+            offset = (work_date - PAY_PERIOD_START).days % PERIODS['Pay period']
+            start = work_date - datetime.timedelta(days=offset)
+        return start, start + datetime.timedelta(days=self.data['period'] - 1)
+
+    def _reload_list(self):
+        self.set_theme(CONFIG['DEFAULT']['theme'])
+        self.save()
+        start, end = self._period()
+        cards = self._db.get_timecards(start, end)
+        total = 0
+        self._labels = {}
+        for day, (work_date, card) in zip(self._days, cards.items()):
+            total += card.hours
+            day.value = (f'{work_date.strftime("%a %d/%b/%Y")}'
+                         f'{len(card):>6} entries{card.hours:>8}')
+            self._labels[work_date] = (day, day.value)
+            # empty weekends are fine, anything else should add up to 8
+            if card.hours != 8.0 and (card or work_date.weekday() < 5):
+                day.custom_colour = 'invalid'
+            else:
+                day.custom_colour = 'edit_text'
+        for day in self._days[len(cards):]:
+            day.value = ''
+        self._total.value = str(total)
+        self._total.custom_colour = 'edit_text'
+        if not self._submitting:
+            self._status.value = ''
+
+    def on_submit(self):
+        """
+        Queue every day of the period that is ready for the outbox to send,
+        or submit the whole crew's in the background
+        """
+        if self._submitting:
+            return
+        self.save()
+        self._status.custom_colour = 'edit_text'
+        if self.data['crew']:
+            self._submitting = True
+            self._status.value = 'Connecting to AiM...'
+            Thread(target=self._submit_crew, args=(self.data['force'],),
+                   daemon=True).start()
+            return
+        ready = []
+        for work_date, card in self._db.get_timecards(*self._period()).items():
+            reason = skip_reason(card, self.data['force'])
+            if reason:
+                self._show_progress(work_date, f'Skipped: {reason}')
+            else:
+                ready.append(work_date)
+        self._db.queue_submissions(ready, self.data['force'])
+        OUTBOX.wake()
+        self._status.value = f'{len(ready)} days queued for AiM'
+
+    def _submit_crew(self, force):
+        "Submit the period for every employee, in parallel"
+        CONFIG.read(CONFIG_FILE)
+        d = CONFIG['DEFAULT']['debug'] == 'True'
+        own = employee_id(self._db.employee)
+        period = self._period()
+        ids = {employee_id(employee): employee for employee in [''] + crew()}
+        crew_cards = {aim_id: self._db.get_timecards(*period, employee)
+                      for aim_id, employee in ids.items()}
+        previous = {aim_id: self._db.get_submissions(*period, employee)
+                    for aim_id, employee in ids.items()}
+        done = []
+
+        def progress(employee, results):
+            done.append(employee)
+            if employee == own:
+                for result in results:
+                    self._post_progress(result.work_date, result.message)
+            self._post_progress(None, f'{len(done)}/{len(crew_cards)} done, '
+                                      f'{employee}: {summary(results)}')
+
+        failed, message = True, 'Submit failed'
+        try:
+            results = submit_crew(CONFIG['AIM']['NETID'], crew_cards, force,
+                                  debug=d, progress=progress, previous=previous)
+            for aim_id, days in results.items():
+                for result in days:
+                    if result.submission:
+                        self._db.save_submission(result.work_date,
+                                                 result.submission, ids[aim_id])
+            failed = any(r.status in (FAILED, UNCONFIRMED)
+                         for days in results.values() for r in days)
+            message = summary([r for days in results.values() for r in days])
+        finally:
+            self._post_progress(None, message, failed, True)
+
+    def _post_progress(self, work_date, message, failed=False, finished=False):
+        "Called from the submit thread; shown on the next frame"
+        self.post(self._show_progress, work_date, message, failed, finished)
+
+    def post_outbox(self, entry, message, status):
+        "Called from the outbox worker; shown on the next frame"
+        self.post(self._show_outbox, entry, message, status)
+
+    def _show_outbox(self, entry, message, status):
+        # only the days of the employee shown
+        if entry is None:
+            if not self._submitting:
+                self._show_progress(None, f'Outbox: {message}')
+        elif entry.employee == self._db.employee:
+            failed = status in (FAILED, PENDING, UNCONFIRMED) or (
+                isinstance(message, Progress) and message.failed)
+            self._show_progress(entry.work_date, str(message), failed)
+
+    def _show_progress(self, work_date, message, failed=False, finished=False):
+        if work_date is None:
+            if finished:
+                self._submitting = False
+            self._status.value = message
+            self._status.custom_colour = 'invalid' if failed else 'edit_text'
+        elif work_date in self._labels:
+            day, label = self._labels[work_date]
+            day.value = f'{label}  {message}'
+            if failed:
+                day.custom_colour = 'invalid'
+
+    def on_done(self):
+        raise NextScene('Main')
+
+    def process_event(self, event):
+        if isinstance(event, KeyboardEvent) and event.key_code == Screen.KEY_ESCAPE:
+            self.on_done()
+        return super().process_event(event)
+
+
+class ReportsView(Frame):
+    "Cross-tabs of hours by time code, read from the rollup tables"
+
+    def __init__(self, screen, db):
+        super().__init__(screen, screen.height, screen.width,
+                         title="Reports",
+                         can_scroll=False,
+                         reduce_cpu=True,
+                         on_load=self._reload_list)
+        self.set_theme(CONFIG['DEFAULT']['theme'])
+        self._db = db
+
+        today = datetime.date.today()
+        self.data['date1'] = datetime.date(today.year, 1, 1)
+        self.data['date2'] = today
+        self.data['report'] = REPORTS['By week']
+
+        head = Layout([1, 1, 1, 1])
+        self._main = Layout([100], fill_frame=True)
+        buttons = Layout([100])
+
+        self.add_layout(head)
+        self.add_layout(self._main)
+        self.add_layout(buttons)
+
+        head.add_widget(DropdownList(list(REPORTS.items()), 'Report:',
+                                     'report', on_change=self._reload_list), 0)
+        head.add_widget(DatePicker('From:', name='date1',
+                                   on_change=self._reload_list), 1)
+        head.add_widget(DatePicker('To:', name='date2',
+                                   on_change=self._reload_list), 2)
+        buttons.add_widget(BoxedButton('Done', self.on_done))
+
+        self.fix()
+
+    def _query(self):
+        "Returns the cross-tab and the title and formatter of its row keys"
+        report, date1, date2 = (self.data['report'],
+                                self.data['date1'], self.data['date2'])
+        if report == REPORTS['By day']:
+            return (self._db.hours_by_day(date1, date2), 'DATE',
+                    lambda k: k.strftime('%a %d/%b/%Y'))
+        if report == REPORTS['By week']:
+            # include the week that date1 falls in
+            date1 -= datetime.timedelta(days=date1.weekday())
+            return (self._db.hours_by_week(date1, date2), 'WEEK OF',
+                    lambda k: k.strftime('%d/%b/%Y'))
+        return (self._db.hours_by_workorder(date1, date2),
+                'WORKORDER/PHASE', lambda k: '{}/{}'.format(*k))
+
+    def _reload_list(self):
+        self.save()
+        table, title, fmt = self._query()
+        codes = {code for row in table.values() for code in row}
+        codes = sorted(codes, key=lambda c: TIME_CODES.get(c, len(TIME_CODES)))
+        options = []
+        totals = defaultdict(float)
+        for i, (key, row) in enumerate(table.items()):
+            for code, hours in row.items():
+                totals[code] += hours
+            cells = [str(row.get(code, '')) for code in codes]
+            options.append(([fmt(key), *cells, str(round(sum(row.values()), 2))], i))
+        cells = [str(round(totals[code], 2)) for code in codes]
+        options.append((['TOTAL', *cells, str(round(sum(totals.values()), 2))],
+                        len(options)))
+
+        # the columns depend on the time codes in the report
+        self._main.clear_widgets()
+        self._main.add_widget(MultiColumnListBox(
+            Widget.FILL_FRAME,
+            [16] + ['>9'] * (len(codes) + 1),
+            options,
+            [title, *codes, 'TOTAL'],
+            name='report_rows'))
+        self.fix()
+
+    def on_done(self):
+        raise NextScene('Main')
+
+    def process_event(self, event):
+        if isinstance(event, KeyboardEvent) and event.key_code == Screen.KEY_ESCAPE:
+            self.on_done()
+        return super().process_event(event)
+
+
 class SettingsView(Frame):
     def __init__(self, screen, db):
         super().__init__(screen,
@@ -650,6 +1234,10 @@ class SettingsView(Frame):
             list(THEME_DICT.items()), 'Theme:', 'theme', self._ch_theme
         )
         self._debug = CheckBox("Debug", name='debug')
+        self._crew = Text('Crew IDs:', 'crew')
+        self._import_file = Text('Import:', 'import_file',
+                                 on_change=self._on_import_file)
+        self._import_file.disabled = True
 
         self.add_layout(form)
         self.add_layout(buttons)
@@ -669,13 +1257,19 @@ class SettingsView(Frame):
         form.add_widget(Divider(draw_line=False))
         form.add_widget(self._theme_select)
         form.add_widget(self._debug)
+        form.add_widget(self._crew)
+        form.add_widget(Divider(draw_line=False))
+        form.add_widget(self._import_file)
 
         buttons.add_widget(BoxedButton('Cancel', self.on_cancel), 0)
+        buttons.add_widget(BoxedButton('Import', self.on_import), 1)
         buttons.add_widget(BoxedButton('Save', self.on_save), 2)
 
         self.fix()
 
     def _load_cfg(self):
+        import keyring
+
         CONFIG.read(CONFIG_FILE)
         self._netid.value = CONFIG['AIM']['NETID']
         self._eid.value = CONFIG['AIM']['EMPLOYEE_ID']
@@ -683,6 +1277,7 @@ class SettingsView(Frame):
         self._pwd.value = keyring.get_password('aim', CONFIG['AIM']['NETID'])
         self._theme_select.value = THEME_DICT[CONFIG['DEFAULT']['theme']]
         self._debug.value = CONFIG['DEFAULT']['debug'] == 'True'
+        self._crew.value = ' '.join(crew())
         self._version.value = f'{version}'
 
     def _ch_theme(self):
@@ -693,6 +1288,22 @@ class SettingsView(Frame):
         self.save()
         self.scene.add_effect(FileBrowsePopup(self.screen, self._dbfile))
 
+    def on_import(self):
+        self._import_file.value = ''
+        self.scene.add_effect(FileBrowsePopup(self.screen, self._import_file))
+
+    def _on_import_file(self):
+        "Import the file picked in the browser"
+        filename = self._import_file.value
+        if not filename:
+            return
+        try:
+            added, skipped = import_file(self._db, filename)
+            message = f'{added} records imported, {skipped} already present'
+        except (OSError, ValueError, KeyError) as e:
+            message = f'Import failed: {e}'
+        self.scene.add_effect(PopUpDialog(self.screen, message, ['OK']))
+
     def on_chpass(self):
         self._edit_pwd = True
         self._pwd.disabled = False
@@ -709,12 +1320,15 @@ class SettingsView(Frame):
         else:
             CONFIG['AIM']['NETID'] = self.data['netid']
             CONFIG['AIM']['EMPLOYEE_ID'] = self.data['id']
+            CONFIG['AIM']['CREW'] = ' '.join(
+                self.data['crew'].replace(',', ' ').split())
             CONFIG['DEFAULT']['db_file'] = self.data['db_file']
             CONFIG['DEFAULT']['debug'] = str(self.data['debug'])
             CONFIG['DEFAULT']['theme'] = themes[self.data['theme']]
             with open(CONFIG_FILE, 'w') as f:
                 CONFIG.write(f)
             if self._edit_pwd:
+                import keyring
                 keyring.set_password(
                     'aim', self.data['netid'], self.data['pwd1'])
             self.scene.remove_effect(self)
@@ -744,16 +1358,6 @@ class SettingsView(Frame):
         scene.add_effect(SettingsView(screen))
 
 
-def init():
-    CONFIG['DEFAULT']['db_file'] = os.path.join(
-        os.path.expanduser('~'), 'Documents', 'time_cards.db')
-    CONFIG['DEFAULT']['theme'] = 'bright'
-    CONFIG['DEFAULT']['debug'] = ''
-    CONFIG['AIM'] = {'EMPLOYEE_ID': '', 'NETID': ''}
-    with open(CONFIG_FILE, 'w') as f:
-        CONFIG.write(f)
-
-
 def wrapper(func: Callable[[Screen, Scene], NoReturn]) -> Callable:
     """
     asciimatics wrapper:
@@ -763,27 +1367,52 @@ def wrapper(func: Callable[[Screen, Scene], NoReturn]) -> Callable:
     """
     def wrapped(*args):
         last_scene = None
-        while True:
-            try:
-                Screen.wrapper(func, catch_interrupt=False,
-                               arguments=(last_scene, *args))
-                sys.exit(0)
-            except ResizeScreenError as e:
-                last_scene = e.scene
+        try:
+            while True:
+                try:
+                    Screen.wrapper(func, catch_interrupt=False,
+                                   arguments=(last_scene, *args))
+                    sys.exit(0)
+                except ResizeScreenError as e:
+                    last_scene = e.scene
+        finally:
+            if OUTBOX is not None:
+                OUTBOX.stop()
+            # waits for the step of a day being sent, at most one AiM timeout
+            AIM_SESSIONS.close()
 
     return wrapped
 
 
 @wrapper
 def main(screen: Screen, scene: Scene) -> NoReturn:
-    if os.path.exists(CONFIG_FILE):
-        CONFIG.read(CONFIG_FILE)
-    else:
-        init()
-    db = TimeCardDatabase(CONFIG['DEFAULT']['db_file'])
-    scenes = [Scene([TimeCardView(screen, db)], -1, name='Main'),
-              Scene([SearchView(screen, db)], -1, name='Search')]
-    screen.play(scenes, stop_on_resize=True, start_scene=scene)
+    global OUTBOX
+    load()
+    with TimeCardDatabase(CONFIG['DEFAULT']['db_file']) as db:
+        timecard = TimeCardView(screen, db)
+        search = SearchView(screen, db)
+        period = PeriodView(screen, db)
+        scenes = [Scene([timecard], -1, name='Main'),
+                  Scene([search], -1, name='Search'),
+                  Scene([period], -1, name='Period'),
+                  Scene([ReportsView(screen, db)], -1, name='Reports')]
+
+        def progress(entry, message, status):
+            timecard.post_outbox(entry, message, status)
+            period.post_outbox(entry, message, status)
+
+        # the worker outlives screens rebuilt after a resize
+        if OUTBOX is None:
+            OUTBOX = OutboxWorker(db, AIM_SESSIONS, progress)
+            OUTBOX.start()
+        else:
+            OUTBOX.db, OUTBOX.progress = db, progress
+            OUTBOX.wake()
+        try:
+            screen.play(scenes, stop_on_resize=True, start_scene=scene)
+        finally:
+            # the views are built again after a resize
+            search.stop()
 
 
 if __name__ == '__main__':